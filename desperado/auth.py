@@ -6,12 +6,17 @@ from lxml import html
 import base64
 import email
 import imaplib
+import json
 import os
-import pickle
 import re
 import requests
+import threading
 import time
 
+from desperado import market
+from desperado import storage
+from desperado import transport
+
 
 LOGIN_API = {
         'refresh_captcha' : {
@@ -71,21 +76,53 @@ LOGIN_API = {
                     'token_secure'   : 'User\'s secure login token.'
                 }
             }
+        },
+        'client_js_token' : {
+            'url'         : 'https://steamcommunity.com/chat/clientjstoken',
+            'method'      : 'GET',
+            'return_type' : 'JSON',
+            'return_keys' : {
+                'logged_in' : 'Is the session logged in?',
+                'steamid'   : 'User\'s Steam ID, if logged in.',
+                'token'     : 'Token for the web chat.'
+            }
         }
 }
 
-def __save_authorized_session(session):
-    filename = session.username + ".session"
-    with open(filename, 'wb') as outfile:
-        pickle.dump(session, outfile)
+# Cookie Steam sets once we're logged in.
+LOGIN_COOKIE = 'steamLoginSecure'
+
+# Directory sessions are saved in when login() isn't given one. Defaults to the current directory.
+SESSION_DIR_ENV = 'DESPERADO_SESSION_DIR'
+
+SESSION_FORMAT_VERSION = 1
 
-def __load_authorized_session(username):
-    filename = username + ".session"
-    if not os.path.isfile(filename):
+def __session_path(username, session_dir):
+    if session_dir is None:
+        session_dir = os.environ.get(SESSION_DIR_ENV, '.')
+    return os.path.join(session_dir, username + ".session.json")
+
+def save_session(session, session_dir = None):
+    """ Atomically writes a session's cookies and profile ID to <username>.session.json
+        in session_dir. The file is only readable by its owner. """
+    path = __session_path(session.username, session_dir)
+    with storage.atomic_write(path) as outfile:
+        json.dump(session.to_json(), outfile)
+    return path
+
+def load_session(username, session_dir = None, price_data_cache = None, rate_limits = None):
+    """ Reads a session saved by save_session. Returns None if there is none, if it was
+        written in another format version, or if its login cookie has expired. """
+    path = __session_path(username, session_dir)
+    if not os.path.isfile(path):
         return None
-    with open(filename, 'rb') as infile:
-        session = pickle.load(infile)
-        return session
+    with open(path) as infile:
+        state = json.load(infile)
+    if state.get('version') != SESSION_FORMAT_VERSION or state.get('username') != username:
+        return None
+    if state['expires_at'] != None and state['expires_at'] <= time.time():
+        return None
+    return Session.from_json(state, price_data_cache, rate_limits)
 
 def get_current_captcha_gid():
     result = requests.get(LOGIN_API['refresh_captcha']['url'])
@@ -97,7 +134,7 @@ def get_captcha_image(gid):
 
 def get_rsa_key(session, username):
     payload = { 'donotcache' : int(time.time()), 'username' : username }
-    result = session.requests_session.post(LOGIN_API['get_rsa_key']['url'], data=payload)
+    result = session.transport.post('login', LOGIN_API['get_rsa_key']['url'], data=payload)
     return result.json()
 
 def get_encrypted_password(password, rsa_mod, pub_exp):
@@ -105,7 +142,7 @@ def get_encrypted_password(password, rsa_mod, pub_exp):
         Returns the base64 encoded ciphertext since that's what Steam's login endpoint wants. """
     public_key = RSA.construct((rsa_mod, pub_exp))
     cipher = PKCS1_v1_5.new(public_key)
-    ciphertext = cipher.encrypt(bytes(password))
+    ciphertext = cipher.encrypt(password.encode('utf-8'))
     return base64.b64encode(ciphertext)
 
 def do_login(session, username, encrypted_password, rsa_timestamp, 
@@ -122,7 +159,7 @@ def do_login(session, username, encrypted_password, rsa_timestamp,
             'rsatimestamp'   : rsa_timestamp,
             'remember_login' : 'false'
    }
-    result = session.requests_session.post(LOGIN_API['do_login']['url'], data=payload)
+    result = session.transport.post('login', LOGIN_API['do_login']['url'], data=payload)
     return result.json()
 
 def solve_captcha_manual(gid):
@@ -182,17 +219,32 @@ def get_steamguard_code_automated_imap(server, login, password,
 
     return auth_code
 
+class SessionExpired(Exception):
+    def __init__(self, reason, username):
+        self.reason   = reason
+        self.username = username
+
 class Session(object):
-    def __init__(self, username):
-        self.username           = username
-        self.requests_session   = requests.Session()
-        self.__profile_id       = None
-        self.__wallet_balance   = None
+    """ A logged in Steam session.
+        validation_interval - Seconds a successful validity probe is trusted for, see is_valid(). """
+    def __init__(self, username, price_data_cache = None, rate_limits = None,
+                 validation_interval = 300, clock = time.time):
+        self.username             = username
+        self.requests_session     = requests.Session()
+        self.transport            = transport.Transport(self.requests_session, rate_limits)
+        self.price_data_cache     = price_data_cache if price_data_cache != None else market.PriceDataCache()
+        self.validation_interval  = validation_interval
+        self.__clock              = clock
+        self.__profile_id         = None
+        self.__wallet_balance     = None
+        self.__validated_at       = None
+        self.__relogin            = None
+        self.__relogin_lock       = threading.Lock()
 
     def __scrape_steam_homepage(self):
         """ Scrapes useful information about user from Steam's homepage. """
         # TODO: Abstract scraping into different page classes/objects.
-        page = self.requests_session.get("https://steamcommunity.com/")
+        page = self.transport.get('community', "https://steamcommunity.com/")
         tree = html.fromstring(page.text)
         profile_url = tree.xpath('//a[@class="menuitem supernav username"]')[0].attrib['href']
         self.__profile_id = re.search("\/(\d+)\/", profile_url).group(1)
@@ -202,32 +254,147 @@ class Session(object):
         # for string in [self.wallet_balance, self.profile_id]:
         # print(string)
 
-    # FIXME: TODO: We need a way to validate that the session is still good. 
-    # and if it's not, then log back in.
-    def __validate_session(self):
-        pass
+    def __login_cookie_expired(self):
+        now = self.__clock()
+        for cookie in self.requests_session.cookies:
+            if cookie.name == LOGIN_COOKIE:
+                return cookie.is_expired(now)
+        return True
+
+    def __probe(self):
+        """ Asks Steam whether we're still logged in, with about the smallest authenticated request there is. """
+        result = self.transport.get('community', LOGIN_API['client_js_token']['url'])
+        if result.status_code != 200:
+            return False
+        try:
+            return bool(result.json().get('logged_in'))
+        except ValueError:
+            return False
+
+    def is_valid(self, force = False):
+        """ Whether the session is still logged in. A missing or expired login cookie fails
+            straight away, otherwise Steam is probed unless a probe succeeded less than 
+            validation_interval seconds ago (or force is set). """
+        if self.__login_cookie_expired():
+            self.__validated_at = None
+            return False
+        if (not force and self.__validated_at != None and
+            self.__clock() - self.__validated_at < self.validation_interval):
+            return True
+        if self.__probe():
+            self.__validated_at = self.__clock()
+            return True
+        self.__validated_at = None
+        return False
+
+    def set_relogin(self, relogin):
+        """ Sets the function ensure_valid() calls with this session to log it back in.
+            It isn't saved with the session. """
+        self.__relogin = relogin
+
+    def ensure_valid(self):
+        """ Logs the session back in if it is no longer valid. Concurrent callers wait for
+            a single re-login. Raises SessionExpired if there's no way to log back in. """
+        if self.is_valid():
+            return self
+        with self.__relogin_lock:
+            # Somebody else may have logged us back in while we waited.
+            if self.is_valid():
+                return self
+            if self.__relogin is None:
+                raise SessionExpired("Session.ensure_valid: Session expired and can't log back in.", self.username)
+            self.requests_session.cookies.clear()
+            self.__relogin(self)
+            self.__validated_at = self.__clock()
+        return self
 
     def wallet_balance(self):
-        if not hasattr(self, '__wallet_balance') or self.__wallet_balance == None:
+        if self.__wallet_balance == None:
             self.__scrape_steam_homepage()
         return self.__wallet_balance
 
     def profile_id(self):
-        if not hasattr(self, '__profile_id') or self.__profile_id == None:
+        if self.__profile_id == None:
             self.__scrape_steam_homepage()
         return self.__profile_id
 
+    def to_json(self):
+        """ The state worth keeping between runs: the cookie jar, profile ID and when the
+            login expires (None if Steam didn't say). """
+        cookies = []
+        expires_at = None
+        for cookie in self.requests_session.cookies:
+            cookies.append({ 'name'    : cookie.name,
+                             'value'   : cookie.value,
+                             'domain'  : cookie.domain,
+                             'path'    : cookie.path,
+                             'secure'  : cookie.secure,
+                             'expires' : cookie.expires,
+                             'rest'    : cookie._rest })
+            if cookie.name == LOGIN_COOKIE and cookie.expires != None:
+                expires_at = cookie.expires
+        return { 'version'    : SESSION_FORMAT_VERSION,
+                 'username'   : self.username,
+                 'profile_id' : self.__profile_id,
+                 'saved_at'   : self.__clock(),
+                 'expires_at' : expires_at,
+                 'cookies'    : cookies }
+
+    @staticmethod
+    def from_json(state, price_data_cache = None, rate_limits = None):
+        session = Session(state['username'], price_data_cache, rate_limits)
+        session.__profile_id = state['profile_id']
+        for cookie in state['cookies']:
+            session.requests_session.cookies.set_cookie(requests.cookies.create_cookie(
+                    cookie['name'], cookie['value'], domain = cookie['domain'], path = cookie['path'],
+                    secure = cookie['secure'], expires = cookie['expires'], rest = cookie['rest']))
+        return session
+
 
 class InvalidLoginState(Exception):
     def __init__(self, reason, response_json_dict):
         self.reason             = reason
         self.response_json_dict = response_json_dict
 
+def __authenticate(session, password, get_steamguard_code, solve_captcha, max_tries):
+    """ Runs Steam's RSA/dologin sequence on session, leaving it logged in. """
+    username = session.username
+    response_dict = get_rsa_key(session, username)
+
+    # The RSA information is encoded as hex strings.
+    # Transform to integers.
+    rsa_mod = int(response_dict['publickey_mod'], 16)
+    pub_exp = int(response_dict['publickey_exp'], 16)
+
+    encrypted_password = get_encrypted_password(password, rsa_mod, pub_exp)
+    timestamp = response_dict['timestamp']
+
+    gid = ''
+    text = ''
+    email_auth = ''
+    for tries in range(max_tries):
+        response_dict = do_login(session, username, encrypted_password, timestamp, email_auth, gid, text)
+        # Steam sends the captcha/emailauth flags on every response, set to false when not needed.
+        if response_dict.get('success'):
+            return
+        elif response_dict.get('captcha_needed'):
+            gid  = response_dict['captcha_gid']
+            text = solve_captcha(gid)
+        elif response_dict.get('emailauth_needed'):
+            email_auth = get_steamguard_code()
+        else:
+            raise InvalidLoginState("I don't understand this state!", response_dict)
+
+    raise Exception("Too many tries!")
+
 # FIXME: Should this be put into the Session object itself?
 def login(username, password, 
           get_steamguard_code = get_steamguard_code_manual, 
           solve_captcha       = solve_captcha_manual,
-          max_tries = 5):
+          max_tries = 5,
+          price_data_cache    = None,
+          rate_limits         = None,
+          session_dir         = None):
     """ Provides a fully automated login sequence to the Steam website. Depends on automated
         functions being passed. Returns a Session object.
         username - Steam username
@@ -237,52 +404,36 @@ def login(username, password,
         solve_captcha       - A function taking 1 argument - The current captcha's gid.
         max_tries           - The maximum  number of times to try to login. If we keep failing 
                               the captcha or steamguard authentication then this function will 
-                              eventually bail."""
+                              eventually bail.
+        price_data_cache    - The price cache to attach to the session, e.g. a 
+                              market.SQLitePriceDataCache to keep prices across runs.
+                              Defaults to an in-memory market.PriceDataCache.
+        rate_limits         - Per endpoint family request rates for the session's transport.
+                              Defaults to transport.RATE_LIMITS.
+        session_dir         - Directory the session is saved in and loaded from. Defaults to 
+                              $DESPERADO_SESSION_DIR, or the current directory.
+        A saved session is reused if it is still valid. The returned session remembers how
+        to log back in, so Session.ensure_valid() can renew it when it expires."""
+
+    def relogin(session):
+        __authenticate(session, password, get_steamguard_code, solve_captcha, max_tries)
+        # Save the new session for later use.
+        save_session(session, session_dir)
 
     # Try to load the cached session information.
-    # FIXME: What if this has expired?
     try:
-        session = __load_authorized_session(username)
-    except ValueError:
+        session = load_session(username, session_dir, price_data_cache, rate_limits)
+    except (ValueError, KeyError, TypeError):
         print("Couldn't load old session!")
         session = None
         
     if session != None:
-        return session
-
-    session = Session(username)
-
-    response_dict = get_rsa_key(session, username)
-
-    # The RSA information is encoded as hex strings.
-    # Transform to integers.
-    rsa_mod = long(response_dict['publickey_mod'], 16)
-    pub_exp = long(response_dict['publickey_exp'], 16)
-
-    encrypted_password = get_encrypted_password(password, rsa_mod, pub_exp)
-    timestamp = response_dict['timestamp']
-
-    gid = ''
-    text = ''
-    email_auth = ''
-    tries = 0
-    while tries < max_tries:
-        tries += 1
-        response_dict = do_login(session, username, encrypted_password, timestamp, email_auth, gid, text)
-        if 'captcha_needed' in response_dict:
-            text = solve_captcha(gid)
-        elif 'emailauth_needed' in response_dict:
-            email_auth = get_steamguard_code()
-        elif 'success' in response_dict and response_dict['success']:
-            break
-        else:
-            raise InvalidLoginState("I don't understand this state!", response_dict)
-
-    if tries >= max_tries:
-        raise Exception("Too many tries!")
+        session.set_relogin(relogin)
+        return session.ensure_valid()
 
-    # Save the new session for later use.
-    __save_authorized_session(session)
+    session = Session(username, price_data_cache, rate_limits)
+    session.set_relogin(relogin)
+    relogin(session)
 
     return session
          
@@ -0,0 +1,129 @@
+import json
+import threading
+
+from desperado import inventory
+from desperado import storage
+
+
+class DescriptionCatalog(object):
+    """ Catalog of ItemDescriptions keyed by (app_id, class_id, instance_id), shared by
+        every account and inventory that resolves through it. Each description is built
+        once and the same object is handed out afterwards, one for tradable copies of an
+        item and one for those on a trade hold. Only the names and tags are persisted,
+        whether a copy can be traded depends on the copy.
+        path    - Optional SQLite database to keep the catalog in across runs. Without one
+                  the catalog only lives in memory.
+        timeout - Seconds to wait on a database locked by another writer. """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS descriptions (
+                    app_id           INTEGER NOT NULL,
+                    class_id         INTEGER NOT NULL,
+                    instance_id      INTEGER NOT NULL,
+                    market_name      TEXT    NOT NULL,
+                    market_hash_name TEXT    NOT NULL,
+                    tags             TEXT    NOT NULL,
+                    PRIMARY KEY (app_id, class_id, instance_id))"""
+
+    def __init__(self, path = None, timeout = 30.0):
+        self.path           = path
+        self.timeout        = timeout
+        self.__lock         = threading.Lock()
+        self.__descriptions = {}
+        self.__pending      = {}
+        if path != None:
+            self.__connections = storage.ThreadConnections(path, timeout)
+            with self.__connections.get() as connection:
+                columns = [row[1] for row in connection.execute("PRAGMA table_info(descriptions)")]
+                if 'tradable' in columns:
+                    # Written when the first copy seen decided tradability for everyone, start over.
+                    connection.execute("DROP TABLE descriptions")
+                connection.execute(self.SCHEMA)
+
+    def __len__(self):
+        return len(self.__descriptions)
+
+    def __build(self, key, market_name, market_hash_name, tags, tradable):
+        return inventory.ItemDescription({
+                'appid'            : key[0],
+                'classid'          : key[1],
+                'instanceid'       : key[2],
+                'market_name'      : market_name,
+                'market_hash_name' : market_hash_name,
+                'tradable'         : 1 if tradable else 0,
+                'tags'             : [{ 'category' : category, 'name' : name } for category, name in tags] })
+
+    def __load(self, key, tradable):
+        row = self.__connections.get().execute(
+                "SELECT market_name, market_hash_name, tags FROM descriptions "
+                "WHERE app_id = ? AND class_id = ? AND instance_id = ?", key).fetchone()
+        if row is None:
+            return None
+        market_name, market_hash_name, tags = row
+        return self.__build(key, market_name, market_hash_name, json.loads(tags), tradable)
+
+    def get(self, app_id, class_id, instance_id, tradable = True):
+        """ Returns the known ItemDescription of the tradable (or trade held) copies of an item, or None. """
+        key = (int(app_id), int(class_id), int(instance_id))
+        with self.__lock:
+            description = self.__descriptions.get(key + (tradable,))
+            if description is None:
+                # We may know the copies with the other tradability already.
+                other = self.__descriptions.get(key + (not tradable,))
+                if other != None:
+                    description = self.__build(key, other.market_name, other.market_hash_name,
+                                               other.tags.items(), tradable)
+                    self.__descriptions[key + (tradable,)] = description
+        if description is None and self.path != None:
+            description = self.__load(key, tradable)
+            if description != None:
+                with self.__lock:
+                    description = self.__descriptions.setdefault(key + (tradable,), description)
+        return description
+
+    def add(self, description):
+        """ Adds a description, returning the catalog's copy if it already had one. """
+        key = (description.app_id, description.class_id, description.instance_id)
+        with self.__lock:
+            known = self.__descriptions.setdefault(key + (description.tradable,), description)
+            if known is description and self.path != None:
+                self.__pending[key] = description
+        return known
+
+    def __replace(self, description):
+        key = (description.app_id, description.class_id, description.instance_id)
+        with self.__lock:
+            self.__descriptions[key + (description.tradable,)] = description
+            # The copies with the other tradability are rebuilt from this one when asked for.
+            self.__descriptions.pop(key + (not description.tradable,), None)
+            if self.path != None:
+                self.__pending[key] = description
+        return description
+
+    def resolve(self, app_id, class_id, instance_id, description_json):
+        """ Returns the catalog's description of an item, adding it from description_json
+            (an rgDescriptions entry) if we haven't seen it before, or replacing it if
+            Steam now describes the item differently, e.g. because it was renamed. """
+        tradable = int(description_json['tradable']) == 1
+        description = self.get(app_id, class_id, instance_id, tradable)
+        if description is None:
+            return self.add(inventory.ItemDescription(description_json))
+        tags = dict((tag['category'], tag['name']) for tag in description_json.get('tags') or ())
+        if not description.matches(description_json) or description.tags != tags:
+            return self.__replace(inventory.ItemDescription(description_json))
+        return description
+
+    def flush(self):
+        """ Writes descriptions added or replaced since the last flush to the database. """
+        if self.path is None:
+            return
+        with self.__lock:
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+        if not pending:
+            return
+        with self.__connections.get() as connection:
+            connection.executemany(
+                    "INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?, ?)",
+                    [(description.app_id, description.class_id, description.instance_id,
+                      description.market_name, description.market_hash_name,
+                      json.dumps(sorted(description.tags.items())))
+                     for description in pending])
@@ -1,5 +1,3 @@
-import pdb
-
 from desperado import auth
 from desperado import market
 
@@ -9,14 +7,19 @@ import credentials
 def steamguard():
     return auth.get_steamguard_code_automated_imap(*credentials.mail())
 
+def report_progress(listing_id, error, done, total):
+    if error is None:
+        print("[" + str(done) + "/" + str(total) + "] Removed: " + str(listing_id))
+    else:
+        print("[" + str(done) + "/" + str(total) + "] Failed to remove: " + str(listing_id))
+
 if __name__ == '__main__':
     session = auth.login(*credentials.steam(), get_steamguard_code = steamguard)
-    listings = market.get_current_listings(session)
+    # Removing listings shifts the pages, so gather them all up front.
+    listings = list(market.iter_current_listings(session))
 
-    for listing in listings:
-        print("Removing: " + str(listing))
-        try:
-            market.remove_listing(session, listing.id)
-        except market.ListingRemovalError as e:
-            pdb.set_trace()
-            quit()
+    summary = market.remove_listings(session, [listing.id for listing in listings],
+                                     workers = 4, progress = report_progress)
+    print(summary)
+    for listing_id, error in summary.failed.items():
+        print("Could not remove " + str(listing_id) + ": " + str(getattr(error, 'reason', error)))
@@ -1,47 +1,329 @@
-import re
+import functools
+import json
+import os
+import time
+
+from desperado import storage
 
 class InvalidCurrencyFormat(Exception):
     def __init__(self, reason, data):
         self.reason = reason
         self.data   = data
 
-# XXX
-# FIXME: We're entering dangerous territory here... test thoroughly before doing anything significant.
-# Or maybe replace entirely.
-# XXX
-class Dollars(object):
-    def __init__(self, dollars, cents):
-        self.dollars    = dollars 
-        self.cents      = cents
-        self.only_cents = dollars * 100 + cents
+class CurrencyMismatch(Exception):
+    def __init__(self, reason, data):
+        self.reason = reason
+        self.data   = data
+
+class MissingConversionRate(Exception):
+    def __init__(self, reason, data):
+        self.reason = reason
+        self.data   = data
+
+# Steam's numeric wallet currency IDs, as sent in the 'currency' parameter of market requests.
+STEAM_CURRENCY_CODES = {
+        1  : 'USD',
+        2  : 'GBP',
+        3  : 'EUR',
+        4  : 'CHF',
+        5  : 'RUB',
+        7  : 'BRL',
+        8  : 'JPY',
+        20 : 'CAD'
+}
+
+STEAM_CURRENCY_IDS = dict((code, currency_id) for currency_id, code in STEAM_CURRENCY_CODES.items())
+
+# How Steam writes amounts in each currency: (prefix, suffix, decimal separator,
+# thousands separator, digits shown after the decimal separator).
+FORMATS = {
+        'USD' : ('$',     '',      '.', ',', 2),
+        'GBP' : ('£',     '',      '.', ',', 2),
+        'EUR' : ('',      '€',     ',', '.', 2),
+        'CHF' : ('CHF ',  '',      '.', ' ', 2),
+        'RUB' : ('',      ' pуб.', ',', ' ', 2),
+        'BRL' : ('R$ ',   '',      ',', '.', 2),
+        'JPY' : ('¥ ',    '',      '.', ',', 0),
+        'CAD' : ('CDN$ ', '',      '.', ',', 2)
+}
+
+# Symbols that identify the currency of a price string. Checked in order, so symbols
+# that contain other symbols ('CDN$', 'R$') come before them ('$').
+SYMBOLS = [
+        ('CDN$', 'CAD'),
+        ('R$',   'BRL'),
+        ('pуб.', 'RUB'),
+        ('руб.', 'RUB'),
+        ('CHF',  'CHF'),
+        ('USD',  'USD'),
+        ('€',    'EUR'),
+        ('£',    'GBP'),
+        ('¥',    'JPY'),
+        ('$',    'USD')
+]
+
+THOUSANDS_SEPARATORS = str.maketrans('', '', ",. '\u00a0\u202f")
+
+def __is_digits(text):
+    return text != '' and all('0' <= character <= '9' for character in text)
+
+def parse_money(text, currency = None):
+    """ Parses a price the way Steam writes it, e.g. "$1,234.56", "1.234,56€", "0,--€",
+        "1 234,56 pуб." or "CDN$ 1.5", into a Money.
+        The last '.' or ',' is the decimal separator when one or two digits (or "--")
+        follow it, otherwise it separates thousands. So "1,234" is 1234 but "1,23" is 1.23.
+        currency - Currency code to expect. The currency is taken from the symbol in the
+                   text when there is one, USD when there is none. """
+    remaining = text.strip()
+    detected  = None
+    for symbol, code in SYMBOLS:
+        if symbol in remaining:
+            if detected != None and detected != code:
+                raise InvalidCurrencyFormat("Found symbols of more than one currency.", text)
+            detected  = code
+            remaining = remaining.replace(symbol, '', 1)
+
+    if currency != None and detected != None and currency != detected:
+        raise InvalidCurrencyFormat("Expected an amount in " + currency + ".", text)
+    currency = currency or detected or 'USD'
+
+    number = remaining.strip()
+    negative = number.startswith('-')
+    if negative:
+        number = number[1:].lstrip()
+
+    whole    = number
+    fraction = ''
+    cut = max(number.rfind('.'), number.rfind(','))
+    if cut >= 0:
+        tail = number[cut + 1:]
+        if tail in ('-', '--') or (len(tail) <= 2 and __is_digits(tail)):
+            whole    = number[:cut]
+            fraction = tail.strip('-')
+
+    whole = whole.translate(THOUSANDS_SEPARATORS)
+    if ((not whole and not fraction) or
+        (whole and not __is_digits(whole)) or
+        (fraction and not __is_digits(fraction))):
+        raise InvalidCurrencyFormat("Could not convert string into an amount of money.", text)
+
+    cents = int(whole or 0) * 100 + int(fraction.ljust(2, '0'))
+    return Money(-cents if negative else cents, currency)
+
+@functools.total_ordering
+class Money(object):
+    """ An amount of money in integer cents (hundredths of the currency's unit, which is
+        also how Steam counts amounts in currencies without subunits) and its currency code.
+        Immutable: arithmetic returns new amounts. Amounts in different currencies can't be
+        added or ordered, doing so raises CurrencyMismatch. """
+    __slots__ = ('_cents', 'currency')
+
+    def __init__(self, cents, currency = 'USD'):
+        object.__setattr__(self, '_cents',   int(cents))
+        object.__setattr__(self, 'currency', currency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money is immutable")
+
+    @property
+    def cents(self):
+        return self._cents
 
     def to_cents(self):
-        return self.only_cents
+        return self._cents
 
     @staticmethod
-    def from_cents(cents):
-        dollars = cents // 100
-        cents   = cents % 100
-        return Dollars(dollars, cents)
+    def from_cents(cents, currency = 'USD'):
+        return Money(cents, currency)
 
     @staticmethod
-    def from_string(text):
-        dollars, cents = Dollars.__parse_string(text)
-        return Dollars(dollars, cents)
+    def from_string(text, currency = None):
+        return parse_money(text, currency)
 
     @staticmethod
-    def __parse_string(text):
-        match = re.search("(\d+)\.(\d+)", text)
-        if match:
-            return (int(match.group(1)), int(match.group(2)))
+    def total(amounts, currency = 'USD'):
+        """ Sums Money amounts of one currency without building the intermediate sums. """
+        cents = 0
+        for amount in amounts:
+            if amount.currency != currency:
+                raise CurrencyMismatch("Money.total: Can't add " + amount.currency + " to " + currency, amount)
+            cents += amount._cents
+        return Money(cents, currency)
 
-        raise InvalidCurrencyFormat("Could not convert string into a dollar amount.", text)
+    def __check_currency(self, other):
+        if self.currency != other.currency:
+            raise CurrencyMismatch("Money: " + self.currency + " and " + other.currency + " don't mix.",
+                                   (self, other))
 
     def __add__(self, other):
-        total_cents = self.only_cents + other.only_cents
-        return Dollars.from_cents(total_cents)
+        if not isinstance(other, Money):
+            return NotImplemented
+        self.__check_currency(other)
+        return Money(self._cents + other._cents, self.currency)
+
+    def __radd__(self, other):
+        # Lets sum() start from its default of 0.
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __sub__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        self.__check_currency(other)
+        return Money(self._cents - other._cents, self.currency)
+
+    def __mul__(self, count):
+        if not isinstance(count, int):
+            return NotImplemented
+        return Money(self._cents * count, self.currency)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self._cents, self.currency)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self._cents == other._cents and self.currency == other.currency
+
+    def __lt__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        self.__check_currency(other)
+        return self._cents < other._cents
+
+    def __hash__(self):
+        return hash((self._cents, self.currency))
+
+    def __bool__(self):
+        return self._cents != 0
+
+    def __reduce__(self):
+        return (Money, (self._cents, self.currency))
+
+    def __repr__(self):
+        return "Money(" + str(self._cents) + ", '" + self.currency + "')"
 
     def __str__(self):
-        return "$%d.%02d" % (self.dollars, self.cents)
+        prefix, suffix, decimal, thousands, digits = FORMATS.get(self.currency, (self.currency + ' ', '', '.', ',', 2))
+        whole, fraction = divmod(abs(self._cents), 100)
+        text = '{:,}'.format(whole).replace(',', thousands)
+        if digits:
+            text += decimal + '%02d' % fraction
+        return ('-' if self._cents < 0 else '') + prefix + text + suffix
+
+class Dollars(Money):
+    """ The old USD only amount, kept for existing callers. Use Money instead.
+        Unlike Money, cents is only the part below a dollar (0-99) and only_cents the whole
+        amount, as they always were. Adding two Dollars gives Dollars. """
+    __slots__ = ()
+
+    def __init__(self, dollars, cents):
+        Money.__init__(self, dollars * 100 + cents, 'USD')
+
+    @property
+    def dollars(self):
+        return self._cents // 100
+
+    @property
+    def cents(self):
+        return self._cents % 100
+
+    @property
+    def only_cents(self):
+        return self._cents
+
+    @staticmethod
+    def from_cents(cents):
+        return Dollars(0, cents)
+
+    @staticmethod
+    def from_string(text):
+        return Dollars(0, parse_money(text, 'USD').to_cents())
+
+    def __add__(self, other):
+        if isinstance(other, Dollars):
+            return Dollars(0, self._cents + other._cents)
+        return Money.__add__(self, other)
+
+    def __reduce__(self):
+        return (Dollars, (0, self._cents))
+
+class ConversionTable(object):
+    """ Approximate exchange rates between Steam wallet currencies, as units of each
+        currency per US dollar. Rates are derived from market prices sampled in several
+        currencies (see market.refresh_conversion_table) and can be kept in a JSON file
+        between runs.
+        path             - Optional JSON file the table is loaded from and saved to.
+        refresh_interval - Seconds after which a rate is considered stale. Stale rates
+                           are still used for conversions, they're just due a refresh. """
+    VERSION = 1
+
+    def __init__(self, path = None, refresh_interval = 24 * 60 * 60, clock = time.time):
+        self.path             = path
+        self.refresh_interval = refresh_interval
+        self.__clock          = clock
+        self.__rates          = { 'USD' : { 'rate' : 1.0, 'refreshed_at' : float('inf'), 'samples' : 0 } }
+        if path != None and os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as infile:
+            table = json.load(infile)
+        if table.get('version') != self.VERSION:
+            return
+        self.__rates.update(table['rates'])
+
+    def save(self):
+        """ Atomically writes the table to its path. """
+        rates = dict((code, entry) for code, entry in self.__rates.items() if code != 'USD')
+        with storage.atomic_write(self.path) as outfile:
+            json.dump({ 'version' : self.VERSION, 'base' : 'USD', 'rates' : rates }, outfile, indent = 2, sort_keys = True)
+
+    def rate(self, code):
+        """ Units of the currency per US dollar, or None if we have no rate for it. """
+        entry = self.__rates.get(code)
+        if entry is None:
+            return None
+        return entry['rate']
+
+    def refreshed_at(self, code):
+        entry = self.__rates.get(code)
+        if entry is None:
+            return None
+        return entry['refreshed_at']
+
+    def is_stale(self, code):
+        """ True if there's no rate for the currency or it is older than the refresh interval. """
+        refreshed_at = self.refreshed_at(code)
+        return refreshed_at is None or self.__clock() - refreshed_at >= self.refresh_interval
+
+    def set_rate(self, code, rate, samples = 1):
+        self.__rates[code] = { 'rate' : float(rate), 'refreshed_at' : self.__clock(), 'samples' : samples }
+
+    def add_samples(self, code, samples):
+        """ Sets the rate of a currency from (usd_amount, amount) pairs of Money, e.g. the
+            prices of the same items in both currencies. The median ratio is used so a
+            single thinly traded item can't skew the rate. Returns the rate. """
+        ratios = sorted(amount.to_cents() / float(usd_amount.to_cents()) for usd_amount, amount in samples
+                        if usd_amount.currency == 'USD' and amount.currency == code and
+                           usd_amount.to_cents() > 0 and amount.to_cents() > 0)
+        if not ratios:
+            raise MissingConversionRate("ConversionTable: No usable samples for " + code, samples)
+        middle = len(ratios) // 2
+        rate = ratios[middle] if len(ratios) % 2 else (ratios[middle - 1] + ratios[middle]) / 2
+        self.set_rate(code, rate, len(ratios))
+        return rate
 
-    
+    def convert(self, amount, code):
+        """ Converts Money into another currency, rounded to the nearest cent. """
+        if amount.currency == code:
+            return amount
+        from_rate = self.rate(amount.currency)
+        to_rate   = self.rate(code)
+        if from_rate is None or to_rate is None:
+            raise MissingConversionRate("ConversionTable: Can't convert " + amount.currency + " to " + code,
+                                        (amount, code))
+        return Money(int(round(amount.to_cents() / from_rate * to_rate)), code)
@@ -1,43 +1,217 @@
+import json
+import os
+import re
+import threading
+
+from desperado import storage
+
+# Applications we always know about: (app_id, name, short name, inventory context).
 APPLICATION_DATA = (
-        (730, 'Counter-Strike: Global Offensive', 'csgo'),
-        (620, 'Portal 2', 'portal2'),
-        (723, 'Steam', 'steam'),
-        (570, 'Dota 2', 'dota2'),
-        (440, 'Team Fortress 2', 'tf2')
+        (730, 'Counter-Strike: Global Offensive', 'csgo', 2),
+        (620, 'Portal 2', 'portal2', 2),
+        (723, 'Steam', 'steam', 2),
+        (570, 'Dota 2', 'dota2', 2),
+        (440, 'Team Fortress 2', 'tf2', 2)
 )
 
-APP_IDS = []
-APP_NAMES = {}
-APP_SHORT_NAMES = {}
-APP_SHORT_NAME_TO_ID = {}
-
-def __init_module():
-    for app_id, app_long_name, app_short_name in APPLICATION_DATA:
-        APP_IDS.append(app_id)
-        APP_NAMES[app_id] = app_long_name
-        APP_SHORT_NAMES[app_id] = app_short_name
-        APP_SHORT_NAME_TO_ID[app_short_name] = app_id
+# Catalog file the default registry extends itself from, if set.
+APP_CATALOG_ENV = 'DESPERADO_APP_CATALOG'
 
 UNKNOWN_APP_NAME       = 'Unknown Application Name'
 UNKNOWN_SHORT_APP_NAME = 'unknown_app'
+INVALID_APP_ID         = 'INVALID_APP_ID'
+
+class Application(object):
+    """ trading - Whether the application has items we trade, as opposed to one we only know
+                  the name of from Steam's app list. """
+    __slots__ = ('app_id', 'name', 'short_name', 'context_id', 'trading')
+
+    def __init__(self, app_id, name, short_name, context_id = 2, trading = True):
+        self.app_id     = app_id
+        self.name       = name
+        self.short_name = short_name
+        self.context_id = context_id
+        self.trading    = trading
+
+    def to_json(self):
+        return { 'appid'      : self.app_id,
+                 'name'       : self.name,
+                 'short_name' : self.short_name,
+                 'context_id' : self.context_id,
+                 'trading'    : self.trading }
+
+def short_name_for(name):
+    """ Derives a short name such as 'portal2' from an application's name. """
+    return re.sub('[^a-z0-9]', '', name.lower())
 
-def __get_name(app_id, name_dict, default_value):
-    try:
+class ApplicationRegistry(object):
+    """ The applications we know by ID and short name. The builtin applications are
+        registered right away, the catalog file isn't read until the first lookup.
+        path    - Optional JSON catalog, either one written by save() or a recorded response
+                  of Steam's ISteamApps/GetAppList. Its entries override the builtin ones.
+                  Applications only listed in GetAppList aren't trading applications.
+        builtin - (app_id, name, short name, context) tuples to start from, all of them
+                  trading applications.
+        The ids, names_by_id, short_names_by_id and ids_by_short_name tables are kept up to
+        date in place as applications are registered. """
+    def __init__(self, path = None, builtin = APPLICATION_DATA):
+        self.path               = path
+        self.ids                = []
+        self.names_by_id        = {}
+        self.short_names_by_id  = {}
+        self.ids_by_short_name  = {}
+        self.__lock             = threading.Lock()
+        self.__loaded           = False
+        self.__by_id            = {}
+        self.__by_short_name    = {}
+        for app_id, name, short_name, context_id in builtin:
+            self.__register(app_id, name, short_name, context_id, True)
+
+    def __ensure_loaded(self):
+        if self.__loaded:
+            return
+        with self.__lock:
+            if self.__loaded:
+                return
+            if self.path != None and os.path.isfile(self.path):
+                self.__load_catalog(self.path)
+            self.__loaded = True
+
+    def __register(self, app_id, name, short_name, context_id, trading):
         app_id = int(app_id)
-    except ValueError:
-        return 'INVALID_APP_ID'
+        if short_name is None:
+            short_name = short_name_for(name)
+        previous = self.__by_id.get(app_id)
+        if trading is None:
+            # Catalog entries that don't say keep what we already knew.
+            trading = previous != None and previous.trading
+        if previous is None:
+            self.ids.append(app_id)
+        elif self.__by_short_name.get(previous.short_name) is previous:
+            del self.__by_short_name[previous.short_name]
+            del self.ids_by_short_name[previous.short_name]
+        application = Application(app_id, name, short_name, context_id, trading)
+        self.__by_id[app_id]            = application
+        self.names_by_id[app_id]        = name
+        self.short_names_by_id[app_id]  = short_name
+        # The first application to claim a short name keeps it.
+        if short_name and short_name not in self.__by_short_name:
+            self.__by_short_name[short_name]   = application
+            self.ids_by_short_name[short_name] = app_id
+        return application
+
+    def __load_catalog(self, path):
+        with open(path) as infile:
+            catalog = json.load(infile)
+        if 'applist' in catalog:
+            entries = catalog['applist']['apps']
+        else:
+            entries = catalog['applications']
+        for entry in entries:
+            if not entry.get('name'):
+                continue
+            self.__register(entry['appid'], entry['name'], entry.get('short_name'), entry.get('context_id', 2),
+                            entry.get('trading'))
+
+    def load_catalog(self, path):
+        """ Registers every application in a catalog file. """
+        self.__ensure_loaded()
+        with self.__lock:
+            self.__load_catalog(path)
+
+    def register(self, app_id, name, short_name = None, context_id = 2, trading = True):
+        """ Adds or replaces an application. short_name defaults to one derived from name. """
+        self.__ensure_loaded()
+        with self.__lock:
+            return self.__register(app_id, name, short_name, context_id, trading)
+
+    def save(self, path = None):
+        """ Atomically writes every known application to path (by default the registry's own). """
+        self.__ensure_loaded()
+        path = path or self.path
+        applications = [application.to_json() for application in self.__by_id.values()]
+        with storage.atomic_write(path) as outfile:
+            json.dump({ 'applications' : applications }, outfile, indent = 2)
+
+    def get(self, app_id):
+        """ The Application with this ID, or None. IDs are ints, strings of digits are
+            accepted too but cost a conversion. """
+        self.__ensure_loaded()
+        application = self.__by_id.get(app_id)
+        if application is None and isinstance(app_id, str) and app_id.isdigit():
+            application = self.__by_id.get(int(app_id))
+        return application
 
-    if app_id in name_dict:
-        return name_dict[app_id]
-    return default_value
+    def by_short_name(self, short_name):
+        self.__ensure_loaded()
+        return self.__by_short_name.get(short_name)
+
+    def app_id(self, short_name):
+        self.__ensure_loaded()
+        return self.__by_short_name[short_name].app_id
+
+    def name(self, app_id):
+        application = self.get(app_id)
+        if application is None:
+            return UNKNOWN_APP_NAME
+        return application.name
+
+    def short_name(self, app_id):
+        application = self.get(app_id)
+        if application is None:
+            return UNKNOWN_SHORT_APP_NAME
+        return application.short_name
+
+    def context_id(self, app_id, default = 2):
+        application = self.get(app_id)
+        if application is None:
+            return default
+        return application.context_id
+
+    def app_ids(self):
+        self.__ensure_loaded()
+        return list(self.ids)
+
+    def trading_app_ids(self):
+        """ IDs of the builtin applications and of those registered or saved as trading ones. """
+        self.__ensure_loaded()
+        return [application.app_id for application in list(self.__by_id.values()) if application.trading]
+
+    def __contains__(self, app_id):
+        return self.get(app_id) != None
+
+    def __len__(self):
+        self.__ensure_loaded()
+        return len(self.__by_id)
+
+    def __iter__(self):
+        self.__ensure_loaded()
+        return iter(list(self.__by_id.values()))
+
+REGISTRY = ApplicationRegistry(os.environ.get(APP_CATALOG_ENV))
+
+def __is_valid_app_id(app_id):
+    return isinstance(app_id, int) or (isinstance(app_id, str) and app_id.isdigit())
+
+# The tables this module used to fill at import time. They're the registry's own, so they
+# pick up applications as they're registered, and the catalog's once it has been loaded.
+APP_IDS              = REGISTRY.ids
+APP_NAMES            = REGISTRY.names_by_id
+APP_SHORT_NAMES      = REGISTRY.short_names_by_id
+APP_SHORT_NAME_TO_ID = REGISTRY.ids_by_short_name
+
+def register(app_id, name, short_name = None, context_id = 2, trading = True):
+    return REGISTRY.register(app_id, name, short_name, context_id, trading)
 
 def app_id(short_name):
-    return APP_SHORT_NAME_TO_ID[short_name]
+    return REGISTRY.app_id(short_name)
 
 def application_name(app_id):
-    return __get_name(app_id, APP_NAMES, UNKNOWN_APP_NAME)
+    if not __is_valid_app_id(app_id):
+        return INVALID_APP_ID
+    return REGISTRY.name(app_id)
 
 def application_short_name(app_id):
-    return __get_name(app_id, APP_SHORT_NAMES, UNKNOWN_SHORT_APP_NAME)
-
-__init_module()
+    if not __is_valid_app_id(app_id):
+        return INVALID_APP_ID
+    return REGISTRY.short_name(app_id)
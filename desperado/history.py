@@ -0,0 +1,85 @@
+import array
+import time
+
+from desperado import market
+from desperado import storage
+
+
+class PriceHistoryStore(object):
+    """ Local store of item price histories, one row of packed arrays per (app_id, market_hash_name).
+        Arrays are stored in the machine's native byte order, so a store shouldn't be moved
+        between machines of different endianness.
+        path    - Location of the SQLite database file.
+        timeout - Seconds to wait on a database locked by another writer. """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS price_history (
+                    app_id           INTEGER NOT NULL,
+                    market_hash_name TEXT    NOT NULL,
+                    timestamps       BLOB    NOT NULL,
+                    prices           BLOB    NOT NULL,
+                    volumes          BLOB    NOT NULL,
+                    refreshed_at     REAL    NOT NULL,
+                    PRIMARY KEY (app_id, market_hash_name))"""
+
+    def __init__(self, path, timeout = 30.0, clock = time.time):
+        self.path          = path
+        self.timeout       = timeout
+        self.__clock       = clock
+        self.__connections = storage.ThreadConnections(path, timeout)
+        with self.__connections.get() as connection:
+            connection.execute(self.SCHEMA)
+
+    def __load_row(self, app_id, market_hash_name):
+        return self.__connections.get().execute(
+                "SELECT timestamps, prices, volumes, refreshed_at FROM price_history "
+                "WHERE app_id = ? AND market_hash_name = ?",
+                (app_id, market_hash_name)).fetchone()
+
+    def load(self, app_id, market_hash_name):
+        """ Returns the stored ItemPriceHistory, or None if we've never fetched this item. """
+        row = self.__load_row(app_id, market_hash_name)
+        if row is None:
+            return None
+        timestamps = array.array('q')
+        prices     = array.array('d')
+        volumes    = array.array('q')
+        timestamps.frombytes(row[0])
+        prices.frombytes(row[1])
+        volumes.frombytes(row[2])
+        return market.ItemPriceHistory(timestamps, prices, volumes)
+
+    def refreshed_at(self, app_id, market_hash_name):
+        row = self.__load_row(app_id, market_hash_name)
+        if row is None:
+            return None
+        return row[3]
+
+    def save(self, app_id, market_hash_name, history):
+        with self.__connections.get() as connection:
+            connection.execute(
+                    "INSERT OR REPLACE INTO price_history VALUES (?, ?, ?, ?, ?, ?)",
+                    (app_id, market_hash_name,
+                     history.timestamps.tobytes(), history.prices.tobytes(), history.volumes.tobytes(),
+                     self.__clock()))
+
+    def remove(self, app_id, market_hash_name):
+        with self.__connections.get() as connection:
+            connection.execute("DELETE FROM price_history WHERE app_id = ? AND market_hash_name = ?",
+                               (app_id, market_hash_name))
+
+    def refresh(self, session, app_id, market_hash_name, max_age = None):
+        """ Brings the stored history of an item up to date and returns it.
+            Only points newer than the last stored one are appended.
+            max_age - If the item was refreshed less than this many seconds ago,
+                      the stored history is returned without asking Steam. """
+        history = self.load(app_id, market_hash_name)
+        if history != None and max_age != None:
+            if self.__clock() - self.refreshed_at(app_id, market_hash_name) < max_age:
+                return history
+
+        fetched = market.get_item_price_history(session, app_id, market_hash_name)
+        if history is None:
+            history = fetched
+        else:
+            history.extend(fetched)
+        self.save(app_id, market_hash_name, history)
+        return history
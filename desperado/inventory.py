@@ -1,6 +1,11 @@
+import collections
+import concurrent.futures
+import os
 import requests
 
+from desperado import data
 from desperado import market
+from desperado import snapshot
 
 INVENTORY_API = {
         'application_inventory' : {
@@ -14,18 +19,169 @@ INVENTORY_API = {
          }
 }
 
+class InventoryIndexes(object):
+    """ Lookup tables over an inventory's items, see Inventory.indexes(). Every table maps
+        to a set of items so that criteria can be intersected without copying. """
+    def __init__(self, items):
+        self.size       = len(items)
+        self.positions  = {}
+        self.tags       = {}
+        self.tag_values = {}
+        self.names      = {}
+        self.tradable   = set()
+        self.untradable = set()
+        for position, item in enumerate(items):
+            self.positions[item] = position
+            for category, value in item.tags.items():
+                self.tags.setdefault(category, {}).setdefault(value, set()).add(item)
+            self.names.setdefault(item.market_hash_name(), set()).add(item)
+            if item.can_trade():
+                self.tradable.add(item)
+            else:
+                self.untradable.add(item)
+        # Lowercased once here so 'contains' queries don't have to on every comparison.
+        for category, values in self.tags.items():
+            self.tag_values[category] = [(value.lower(), value) for value in values]
+
+    def tag_contains(self, category, search_str):
+        search_str = search_str.lower()
+        items_by_value = self.tags.get(category, {})
+        matches = [items_by_value[value] for lowered, value in self.tag_values.get(category, ())
+                   if search_str in lowered]
+        if len(matches) == 1:
+            return matches[0]
+        return set().union(*matches)
+
 class Inventory(object):
-    def __init__(self, profile_id, items):
+    def __init__(self, profile_id, items, app_id = None, context_id = None):
         self.profile_id = profile_id
+        self.app_id     = app_id
+        self.context_id = context_id
+        self.__indexes  = None
         self.items      = items
 
+    @property
+    def items(self):
+        return self.__items
+
+    @items.setter
+    def items(self, items):
+        self.__items   = items
+        self.__indexes = None
+
+    def add(self, item):
+        self.__items.append(item)
+        self.__indexes = None
+
+    def remove(self, item):
+        self.__items.remove(item)
+        self.__indexes = None
+
+    def items_by_id(self):
+        return dict((item.id(), item) for item in self.items)
+
+    def indexes(self):
+        """ Returns the InventoryIndexes of this inventory, building them on first use.
+            Assigning items, add() and remove() drop them. Call invalidate_indexes() after
+            editing the items list directly; a change in its length is noticed regardless. """
+        if self.__indexes is None or self.__indexes.size != len(self.__items):
+            self.__indexes = InventoryIndexes(self.__items)
+        return self.__indexes
+
+    def invalidate_indexes(self):
+        self.__indexes = None
+
+    def __lookup(self, indexes, field, value):
+        if field == 'tradable':
+            return indexes.tradable if value else indexes.untradable
+        if field == 'market_hash_name':
+            return indexes.names.get(value, frozenset())
+        if field.endswith('__contains'):
+            return indexes.tag_contains(field[:-len('__contains')], value)
+        if '__' in field:
+            raise ValueError("Inventory.where: Unsupported lookup '" + field + "'")
+        return indexes.tags.get(field, {}).get(value, frozenset())
+
+    def where(self, **criteria):
+        """ Returns the items matching every criterion, in inventory order. Answered from the indexes.
+            tradable = True/False     - Whether the item can be traded.
+            market_hash_name = name   - Exact market_hash_name.
+            Category = value          - The item's tag in this category is exactly value.
+            Category__contains = text - The item's tag in this category contains text, ignoring case.
+            e.g. inv.where(Type__contains = 'Container', tradable = True)
+            Categories with spaces can be passed with inv.where(**{'Sticker Category' : ...}). """
+        indexes = self.indexes()
+        if not criteria:
+            return list(self.items)
+
+        # Smallest first, so every intersection only walks the fewest items left.
+        candidates = sorted((self.__lookup(indexes, field, value) for field, value in criteria.items()), key = len)
+        matches = candidates[0]
+        for other in candidates[1:]:
+            if not matches:
+                break
+            matches = matches & other
+
+        return sorted(matches, key = indexes.positions.__getitem__)
+
+class ItemDescription(object):
+    """ The parts of an rgDescriptions entry we use, shared by every item with the same 
+        classid/instanceid. Tags are only parsed the first time they are asked for. """
+    __slots__ = ('app_id', 'class_id', 'instance_id', 'market_name', 'market_hash_name', 
+                 'tradable', '_raw_tags', '_tags')
+
+    def __init__(self, description_json):
+        self.app_id           = int(description_json['appid'])
+        self.class_id         = int(description_json['classid'])
+        self.instance_id      = int(description_json['instanceid'])
+        # TODO: Does the market_hash_name always equal the market_name?
+        self.market_name      = description_json['market_name']
+        self.market_hash_name = description_json.get('market_hash_name', self.market_name)
+        self.tradable         = int(description_json['tradable']) == 1
+        self._raw_tags        = description_json.get('tags') or ()
+        self._tags            = None
+
+    def matches(self, description_json):
+        """ Whether an rgDescriptions entry still describes the item the way we do, i.e. its
+            names and tradability haven't changed, e.g. because a trade hold expired. """
+        return (self.tradable         == (int(description_json['tradable']) == 1) and
+                self.market_name      == description_json['market_name'] and
+                self.market_hash_name == description_json.get('market_hash_name', description_json['market_name']))
+
+    def key(self):
+        """ The classid_instanceid key Steam uses for this description in rgDescriptions. """
+        return str(self.class_id) + "_" + str(self.instance_id)
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            tags = {}
+            for tag in self._raw_tags:
+                tags[tag['category']] = tag['name']
+            self._tags     = tags
+            self._raw_tags = None
+        return self._tags
+
 class InventoryItem(object):
-    def __init__(self, id_json, description_json):
-        self._id_json = id_json
-        self._description_json = description_json
-        self.tags = {}
-        self.__parse_tags()
-        self.price_data = None
+    __slots__ = ('_asset_id', '_class_id', '_instance_id', '_amount', 'description', 'price_data')
+
+    def __init__(self, asset_id, class_id, instance_id, amount, description):
+        self._asset_id    = asset_id
+        self._class_id    = class_id
+        self._instance_id = instance_id
+        self._amount      = amount
+        self.description  = description
+        self.price_data   = None
+
+    @staticmethod
+    def from_json(id_json, description):
+        """ Builds an item from its rgInventory entry and its (shared) ItemDescription. """
+        return InventoryItem(int(id_json['id']), int(id_json['classid']), int(id_json['instanceid']),
+                             int(id_json['amount']), description)
+
+    @property
+    def tags(self):
+        return self.description.tags
 
     def get_price_data(self, session):
         if not self.can_trade():
@@ -36,44 +192,38 @@ class InventoryItem(object):
         self.price_data = market.get_item_price_overview(session, self.app_id(), self.market_hash_name())
         return self.price_data
 
-    def __parse_tags(self):
-        for tag in self._description_json['tags']:
-            self.tags[tag['category']] = tag['name']
-
     def has_tag(self, category):
-        return category in self.tags
+        return category in self.description.tags
 
     def tag_contains(self, category, search_str):
         if self.has_tag(category):
-            return search_str.lower() in self.tags[category].lower()
+            return search_str.lower() in self.description.tags[category].lower()
         return False
 
     def id(self):
-        return self._id_json['id']
+        return self._asset_id
 
     def instance_id(self):
-        return self._id_json['instanceid']
+        return self._instance_id
 
     def class_id(self):
-        return self._id_json['classid']
+        return self._class_id
 
     def app_id(self):
-        return self._description_json['appid']
+        return self.description.app_id
 
     # TODO: Is this ever greater than 1?
     def amount(self):
-        return self._id_json['amount']
+        return self._amount
 
-    # TODO: Does the market_hash_name always equal the market_name?
     def market_name(self):
-        return self._description_json['market_name']
+        return self.description.market_name
 
-    # FIXME: May need to default to the 'market_name' if this is undefined.
     def market_hash_name(self):
-        return self._description_json['market_hash_name']
+        return self.description.market_hash_name
 
     def can_trade(self):
-        return int(self._description_json['tradable']) == 1
+        return self.description.tradable
 
 def __build_inventory_get_url(profile_id, app_id, context_id):
     return "/".join(["https://steamcommunity.com/profiles", str(profile_id), "inventory/json", str(app_id), str(context_id)]) + "/"
@@ -85,30 +235,297 @@ class InventoryRetrievalError(Exception):
         self.response   = response
 
 # TODO: I don't know why context_id should be 2...
-def retrieve_profile_inventory(session, app_id, context_id = 2):
-    # FIXME: Handle cases where we need to retrieve more...
+def iter_profile_inventory(session, app_id, context_id = 2, page_size = 2000, previous = None, catalog = None):
+    """ Generator over the items of the user's inventory for one application.
+        Follows the 'more'/'more_start' cursor, requesting one page at a time and 
+        matching each page's items with that page's descriptions as it arrives,
+        so only a single page is held in memory.
+        page_size - Number of items to ask for per page, sent as 'count'. Steam may 
+                    return fewer. 
+        previous  - An earlier Inventory of the same app. Its items are yielded again
+                    instead of being rebuilt when neither their asset nor their description
+                    (see ItemDescription.matches) has changed. 
+        catalog   - Optional catalog.DescriptionCatalog to resolve descriptions through,
+                    so descriptions seen before (by any account) aren't rebuilt. """
     profile_id = session.profile_id()
     url = __build_inventory_get_url(profile_id, app_id, context_id)
-    result = session.requests_session.get(url) 
-    result_dict = result.json()
+    # Items with the same classid/instanceid share a single ItemDescription.
+    descriptions_by_key = {}
+    previous_items = {}
+    previous_descriptions = {}
+    if previous != None:
+        previous_items = previous.items_by_id()
+        for item in previous.items:
+            previous_descriptions[item.description.key()] = item.description
+    start = 0
+    while True:
+        result = session.transport.get('inventory', url, params = { 'start' : start, 'count' : page_size })
+        result_dict = result.json()
+
+        if not result_dict or not result_dict['success']:
+            raise InventoryRetrievalError('retrieve_inventory: Could not retrieve inventory!', 
+                                          (session, profile_id, app_id, context_id),
+                                          result_dict)
+
+        # Steam sends empty lists instead of empty objects for empty pages.
+        assets       = result_dict['rgInventory'] or {}
+        descriptions = result_dict['rgDescriptions'] or {}
+
+        # Build Items by matching each item with its description.
+        for item in assets.values():
+            key = str(item['classid']) + "_" + str(item['instanceid'])
+            description = descriptions_by_key.get(key)
+            if description is None:
+                # The page's own description wins, the previous one is only kept if it still matches.
+                description = previous_descriptions.get(key)
+                if description is None or not description.matches(descriptions[key]):
+                    if catalog != None:
+                        description = catalog.resolve(app_id, item['classid'], item['instanceid'], descriptions[key])
+                    else:
+                        description = ItemDescription(descriptions[key])
+                descriptions_by_key[key] = description
+
+            previous_item = previous_items.get(int(item['id']))
+            if (previous_item != None and
+                previous_item.description is description and
+                previous_item.amount() == int(item['amount'])):
+                yield previous_item
+                continue
+            yield InventoryItem.from_json(item, description)
+
+        if catalog != None:
+            catalog.flush()
+        if not result_dict.get('more'):
+            return
+        start = int(result_dict['more_start'])
+
+def retrieve_profile_inventory(session, app_id, context_id = 2, previous = None, catalog = None):
+    """ Retrieves the user's whole inventory for one application.
+        previous - An earlier Inventory of the same app whose unchanged items are reused. 
+        catalog  - Optional catalog.DescriptionCatalog to resolve descriptions through. """
+    items = list(iter_profile_inventory(session, app_id, context_id, previous = previous, catalog = catalog))
+    return Inventory(session.profile_id(), items, app_id, context_id)
+
+class AccountInventory(object):
+    """ Account wide view over the inventories of several applications.
+        inventories - Dict of app_id to its Inventory.
+        errors      - Dict of app_id to the exception raised while retrieving it. """
+    def __init__(self, inventories, errors):
+        self.inventories = inventories
+        self.errors      = errors
+
+    def __app_id(self, app_id):
+        # Applications can also be given by short name, e.g. 'csgo'.
+        if isinstance(app_id, str) and not app_id.isdigit():
+            application = data.REGISTRY.by_short_name(app_id)
+            return application.app_id if application != None else app_id
+        return app_id
+
+    def __getitem__(self, app_id):
+        return self.inventories[self.__app_id(app_id)]
+
+    def __contains__(self, app_id):
+        return self.__app_id(app_id) in self.inventories
+
+    def items(self):
+        """ Generator over the items of every application. """
+        for inv in self.inventories.values():
+            for item in inv.items:
+                yield item
+
+    def where(self, **criteria):
+        """ Inventory.where over every application's inventory. """
+        matches = []
+        for inv in self.inventories.values():
+            matches.extend(inv.where(**criteria))
+        return matches
+
+def retrieve_all_inventories(session, app_ids = None, workers = 4, context_id = None, catalog = None):
+    """ Retrieves the inventories of several applications concurrently. Requests still
+        queue on the 'inventory' rate limit.
+        app_ids    - The applications to retrieve. Defaults to the trading applications in
+                     data.REGISTRY, not every application a Steam app list made it aware of.
+        context_id - Context to retrieve, either one for every app or a dict of app_id to context.
+                     Applications without one use the context they're registered with.
+        catalog    - Optional catalog.DescriptionCatalog shared by every application's retrieval.
+        Returns an AccountInventory. An application that fails doesn't stop the others,
+        its error is recorded in the AccountInventory's errors instead. """
+    if app_ids is None:
+        app_ids = data.REGISTRY.trading_app_ids()
+    app_ids = list(collections.OrderedDict.fromkeys(app_ids))
+    inventories = collections.OrderedDict()
+    errors = collections.OrderedDict()
+    if not app_ids:
+        return AccountInventory(inventories, errors)
+
+    # Look the profile up once rather than racing to scrape it from every worker.
+    session.profile_id()
+
+    def context_for(app_id):
+        if isinstance(context_id, dict) and app_id in context_id:
+            return context_id[app_id]
+        if context_id != None and not isinstance(context_id, dict):
+            return context_id
+        return data.REGISTRY.context_id(app_id)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(app_ids))) as executor:
+        futures = [executor.submit(retrieve_profile_inventory, session, app_id, context_for(app_id),
+                                   catalog = catalog)
+                   for app_id in app_ids]
+        for app_id, future in zip(app_ids, futures):
+            try:
+                inventories[app_id] = future.result()
+            except (InventoryRetrievalError, requests.RequestException, ValueError) as error:
+                errors[app_id] = error
+
+    return AccountInventory(inventories, errors)
+
+class InventoryValuation(object):
+    """ Result of value(). All amounts are integer cents.
+        strategy    - 'low' or 'median', which market price each item was valued at.
+        price_data  - Dict of (app_id, market_hash_name) to the ItemPriceData fetched for it.
+        unit_prices - Dict of (app_id, market_hash_name) to the price of one such item.
+        list_prices - Dict of (app_id, market_hash_name) to the price to list one at so 
+                      the buyer pays its unit price, i.e. what we receive after fees. 
+        counts      - Dict of (app_id, market_hash_name) to how many of the items were valued.
+        total       - Sum of the unit prices of every item.
+        net_total   - Sum of the list prices of every item.
+        tag_totals  - Dict of tag category to tag value to the sum of the unit prices of 
+                      the items carrying that tag.
+        errors      - Dict of (app_id, market_hash_name) to the error its price lookup failed
+                      with. Those items are valued at zero. """
+    def __init__(self, strategy):
+        self.strategy    = strategy
+        self.price_data  = {}
+        self.unit_prices = {}
+        self.list_prices = {}
+        self.counts      = {}
+        self.total       = 0
+        self.net_total   = 0
+        self.tag_totals  = {}
+        self.errors      = {}
+
+    def price_of(self, item):
+        if not item.can_trade():
+            return 0
+        return self.unit_prices.get((item.app_id(), item.market_hash_name()), 0)
+
+    def list_price_of(self, item):
+        if not item.can_trade():
+            return 0
+        return self.list_prices.get((item.app_id(), item.market_hash_name()), 0)
+
+    def sales(self, items):
+        """ (item, list_price) pairs ready for market.post_items_for_sale, leaving out 
+            items that aren't worth enough to be listed. """
+        return [(item, self.list_price_of(item)) for item in items if self.list_price_of(item) > 0]
+
+VALUATION_STRATEGIES = ('low', 'median')
+
+def value(session, inv, strategy = 'low', items = None, workers = 8, currency = 1, conversion_table = None):
+    """ Values an inventory, fetching the price of each distinct item only once.
+        strategy - 'low' to use the lowest listing price, 'median' for the median sale price.
+        items    - Optional subset of the inventory's items to value instead of all of them.
+        workers  - Maximum number of price requests in flight at the same time.
+        currency and conversion_table choose the wallet currency to value the items in,
+        see market.get_item_price_overview. 
+        Untradable items are valued at zero without asking for their price, items whose
+        price couldn't be looked up are valued at zero too (see InventoryValuation.errors).
+        Returns an InventoryValuation. """
+    if strategy not in VALUATION_STRATEGIES:
+        raise ValueError("value: Unknown strategy '" + str(strategy) + "'")
+    if items is None:
+        items = inv.items
+
+    valuation = InventoryValuation(strategy)
+    tradable = []
+    for item in items:
+        if item.can_trade():
+            key = (item.app_id(), item.market_hash_name())
+            valuation.counts[key] = valuation.counts.get(key, 0) + 1
+            tradable.append(item)
+
+    keys = list(valuation.counts)
+    valuation.price_data = market.get_item_price_overviews(session, keys, workers = workers, currency = currency,
+                                                           conversion_table = conversion_table,
+                                                           errors = valuation.errors)
+    for key in keys:
+        price_data = valuation.price_data.get(key)
+        if price_data is None:
+            valuation.unit_prices[key] = 0
+            continue
+        price = price_data.low_price if strategy == 'low' else price_data.median_price
+        valuation.unit_prices[key] = price.to_cents()
+
+    # Listing anything costs at least a cent for each fee, so cheaper items can't be sold.
+    list_prices = market.get_desired_prices([valuation.unit_prices[key] for key in keys])
+    for key, list_price in zip(keys, list_prices):
+        valuation.list_prices[key] = max(int(list_price), 0)
+
+    for item in tradable:
+        key = (item.app_id(), item.market_hash_name())
+        unit_price = valuation.unit_prices[key]
+        valuation.total     += unit_price
+        valuation.net_total += valuation.list_prices[key]
+        for category, tag_value in item.tags.items():
+            category_totals = valuation.tag_totals.setdefault(category, {})
+            category_totals[tag_value] = category_totals.get(tag_value, 0) + unit_price
+
+    return valuation
+
+def save_inventory_snapshot(inv, path):
+    """ Writes an Inventory to path, atomically replacing any earlier snapshot.
+        See the snapshot module for the format. """
+    snapshot.save_snapshot(inv, path)
+
+def load_inventory_snapshot(path, catalog = None):
+    """ Reads an Inventory written by save_inventory_snapshot. 
+        catalog - Optional catalog.DescriptionCatalog to resolve the descriptions through.
+        Returns None if there is no snapshot at path or it isn't one we can read. """
+    if not os.path.isfile(path):
+        return None
+    try:
+        return snapshot.load_snapshot(path, catalog)
+    except snapshot.SnapshotError:
+        return None
+
+class InventorySync(object):
+    """ Result of sync_profile_inventory. 
+        inventory - The up to date Inventory.
+        added     - Asset IDs that weren't in the snapshot.
+        removed   - Asset IDs of the snapshot that are gone.
+        changed   - Asset IDs still present whose class, instance, amount or description 
+                    (e.g. tradability) changed. """
+    def __init__(self, inventory, added, removed, changed):
+        self.inventory = inventory
+        self.added     = added
+        self.removed   = removed
+        self.changed   = changed
 
-    if result_dict['more']:
-        raise InventoryRetrievalError('retrieve_profile_inventory: More inventory available! NOT IMPLEMENTED YET!',
-                                      (session, profile_id, app_id, context_id),
-                                      result_dict)
+    def __str__(self):
+        return " ".join(["Added:",   str(len(self.added)),
+                         "Removed:", str(len(self.removed)),
+                         "Changed:", str(len(self.changed))])
 
-    if not result_dict['success']:
-        raise InventoryRetrievalError('retrieve_inventory: Could not retrieve inventory!', 
-                                      (session, profile_id, app_id, context_id),
-                                      result_dict)
+def sync_profile_inventory(session, app_id, snapshot_path, context_id = 2, catalog = None):
+    """ Retrieves the user's inventory for one application and compares it with the snapshot 
+        at snapshot_path. Items that didn't change are reused from the snapshot instead of 
+        being rebuilt, and the snapshot is updated afterwards. Returns an InventorySync. 
+        catalog - Optional catalog.DescriptionCatalog to resolve descriptions through. """
+    previous = load_inventory_snapshot(snapshot_path, catalog)
+    if previous != None and (previous.profile_id != session.profile_id() or
+                             previous.app_id     != app_id or
+                             previous.context_id != context_id):
+        previous = None
 
-    items = []
+    current = retrieve_profile_inventory(session, app_id, context_id, previous = previous, catalog = catalog)
 
-    # Build Items by matching each item with its description.
-    for item in result_dict['rgInventory'].values():
-        class_id    = item['classid']
-        instance_id = item['instanceid'] 
-        description = result_dict['rgDescriptions'][str(class_id) + "_" + str(instance_id)]
-        items.append(InventoryItem(item, description))
+    previous_items = previous.items_by_id() if previous != None else {}
+    current_items  = current.items_by_id()
+    added   = [asset_id for asset_id in current_items if asset_id not in previous_items]
+    removed = [asset_id for asset_id in previous_items if asset_id not in current_items]
+    changed = [asset_id for asset_id, item in current_items.items()
+               if asset_id in previous_items and item is not previous_items[asset_id]]
 
-    return Inventory(profile_id, items)
+    save_inventory_snapshot(current, snapshot_path)
+    return InventorySync(current, added, removed, changed)
@@ -1,14 +1,27 @@
+import array
+import bisect
+import calendar
+import codecs
+import collections
+import concurrent.futures
 import copy
 import requests
 import math
+import threading
+import time
 import unittest
 import urllib
 import re
 from lxml import html
 
-from desperdao import currency
+from desperado import currency
+from desperado import storage
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-import pdb
 
 class RequestFailure(Exception):
     def __init__(self, reason, arguments):
@@ -18,44 +31,216 @@ class RequestFailure(Exception):
 class ItemPriceOverviewRetreivalFailure(RequestFailure):
     pass
 
+# What looking up a single price can fail with, short of a bug.
+PRICE_LOOKUP_ERRORS = (RequestFailure, requests.RequestException, KeyError, ValueError, currency.InvalidCurrencyFormat)
+
 
-# FIXME: Need a way to invalidate old data.
 class PriceDataCache(object):
-    def __init__(self, session):
-        self.__session = session
-        self.__cache = {}
-    
-    def get_data(self, app_id, market_hash_name):
-        if (app_id, market_hash_name) not in self.__cache:
+    """ In-memory cache of ItemPriceData keyed by (app_id, market_hash_name).
+        ttl      - Seconds an entry stays fresh. None means entries never expire.
+        max_size - Maximum number of entries held. The least recently used entry
+                   is evicted once this is exceeded. None means unbounded.
+        clock    - Function returning the current time in seconds. """
+    def __init__(self, ttl = 300, max_size = 10000, clock = time.time):
+        self.ttl       = ttl
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.__clock   = clock
+        self.__lock    = threading.Lock()
+        self.__cache   = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__cache)
+
+    def __is_expired(self, fetched_at):
+        return self.ttl is not None and self.__clock() - fetched_at >= self.ttl
+
+    def get_data(self, app_id, market_hash_name, currency = 1):
+        key = (app_id, market_hash_name, currency)
+        with self.__lock:
+            entry = self.__cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, fetched_at = entry
+            if self.__is_expired(fetched_at):
+                del self.__cache[key]
+                self.misses += 1
+                return None
+            self.__cache.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set_data(self, app_id, market_hash_name, data, currency = 1):
+        key = (app_id, market_hash_name, currency)
+        with self.__lock:
+            self.__cache[key] = (data, self.__clock())
+            self.__cache.move_to_end(key)
+            while self.max_size is not None and len(self.__cache) > self.max_size:
+                self.__cache.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, app_id = None, market_hash_name = None):
+        """ Drops every entry matching the given app_id and/or market_hash_name.
+            With no arguments the whole cache is cleared. Returns the number of
+            entries dropped. """
+        with self.__lock:
+            if app_id is None and market_hash_name is None:
+                count = len(self.__cache)
+                self.__cache.clear()
+                return count
+            stale_keys = [key for key in self.__cache
+                          if (app_id is None or key[0] == app_id) and
+                             (market_hash_name is None or key[1] == market_hash_name)]
+            for key in stale_keys:
+                del self.__cache[key]
+            return len(stale_keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return { 'size'      : len(self.__cache),
+                 'hits'      : self.hits,
+                 'misses'    : self.misses,
+                 'evictions' : self.evictions }
+
+class SQLitePriceDataCache(object):
+    """ On-disk cache of ItemPriceData with the same interface as PriceDataCache.
+        Entries survive restarts and can be shared by several processes, since the
+        database runs in WAL mode and each thread gets its own connection.
+        path     - Location of the SQLite database file.
+        ttl      - Seconds an entry stays fresh, measured from its fetch timestamp.
+                   None means entries never expire.
+        max_size - Maximum number of entries kept. The oldest fetched entries are
+                   dropped once this is exceeded. None means unbounded.
+        timeout  - Seconds to wait on a database locked by another writer. """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS price_data (
+                    app_id           INTEGER NOT NULL,
+                    market_hash_name TEXT    NOT NULL,
+                    low_price        TEXT    NOT NULL,
+                    volume,
+                    median_price     TEXT    NOT NULL,
+                    fetched_at       REAL    NOT NULL,
+                    currency         INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (app_id, market_hash_name, currency))"""
+
+    def __init__(self, path, ttl = 300, max_size = None, timeout = 30.0, clock = time.time):
+        self.path          = path
+        self.ttl           = ttl
+        self.max_size      = max_size
+        self.timeout       = timeout
+        self.hits          = 0
+        self.misses        = 0
+        self.evictions     = 0
+        self.__clock       = clock
+        self.__connections = storage.ThreadConnections(path, timeout)
+        with self.__connections.get() as connection:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(price_data)")]
+            if columns and 'currency' not in columns:
+                # Written before prices were kept per currency. It's only a cache, start over.
+                connection.execute("DROP TABLE price_data")
+            connection.execute(self.SCHEMA)
+            connection.execute("CREATE INDEX IF NOT EXISTS price_data_fetched_at ON price_data (fetched_at)")
+
+    def __freshness_cutoff(self):
+        if self.ttl is None:
+            return float('-inf')
+        return self.__clock() - self.ttl
+
+    def __len__(self):
+        return self.__connections.get().execute("SELECT COUNT(*) FROM price_data").fetchone()[0]
+
+    def get_data(self, app_id, market_hash_name, currency = 1):
+        row = self.__connections.get().execute(
+                "SELECT low_price, volume, median_price FROM price_data "
+                "WHERE app_id = ? AND market_hash_name = ? AND currency = ? AND fetched_at > ?",
+                (app_id, market_hash_name, currency, self.__freshness_cutoff())).fetchone()
+        if row is None:
+            self.misses += 1
             return None
-        return self.__cache[(app_id, market_hash_name)]
-
-    def set_data(self, app_id, market_hash_name, data):
-        self.__cache[(app_id, market_hash_name)] = data
+        self.hits += 1
+        return ItemPriceData(*row)
+
+    def set_data(self, app_id, market_hash_name, data, currency = 1):
+        with self.__connections.get() as connection:
+            connection.execute(
+                    "INSERT OR REPLACE INTO price_data VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (app_id, market_hash_name, str(data.low_price), data.volume,
+                     str(data.median_price), self.__clock(), currency))
+            if self.max_size is not None:
+                cursor = connection.execute(
+                        "DELETE FROM price_data WHERE rowid IN ("
+                        "SELECT rowid FROM price_data ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_size,))
+                self.evictions += cursor.rowcount
+
+    def invalidate(self, app_id = None, market_hash_name = None):
+        """ Drops every entry matching the given app_id and/or market_hash_name.
+            With no arguments the whole cache is cleared. Returns the number of
+            entries dropped. """
+        clauses = []
+        arguments = []
+        if app_id is not None:
+            clauses.append("app_id = ?")
+            arguments.append(app_id)
+        if market_hash_name is not None:
+            clauses.append("market_hash_name = ?")
+            arguments.append(market_hash_name)
+        query = "DELETE FROM price_data"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self.__connections.get() as connection:
+            return connection.execute(query, arguments).rowcount
+
+    def purge_expired(self):
+        """ Deletes entries that are no longer fresh. Returns the number dropped. """
+        with self.__connections.get() as connection:
+            cursor = connection.execute("DELETE FROM price_data WHERE fetched_at <= ?",
+                                        (self.__freshness_cutoff(),))
+            self.evictions += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return { 'size'      : len(self),
+                 'hits'      : self.hits,
+                 'misses'    : self.misses,
+                 'evictions' : self.evictions }
 
 class ItemPriceData(object):
-    def __init__(self, low_price, volume, median_price):
-        self.low_price    = currency.Dollars.from_string(low_price)
+    """ Prices are given as Steam writes them (or as currency.Money) and kept as currency.Money.
+        A missing median price is taken to be zero. """
+    def __init__(self, low_price, volume, median_price = None):
+        if not isinstance(low_price, currency.Money):
+            low_price = currency.Money.from_string(low_price)
+        if median_price is None:
+            median_price = currency.Money(0, low_price.currency)
+        elif not isinstance(median_price, currency.Money):
+            median_price = currency.Money.from_string(median_price)
+        self.low_price    = low_price
         self.volume       = volume
-        self.median_price = currency.Dollars.from_string(median_price)
+        self.median_price = median_price
+
+    def convert(self, conversion_table, code):
+        """ This price data in another currency, using the rates of a currency.ConversionTable. """
+        return ItemPriceData(conversion_table.convert(self.low_price, code), self.volume,
+                             conversion_table.convert(self.median_price, code))
 
     def __str__(self):
         return " ".join(["Low:", str(self.low_price), 
                          "Median:", str(self.median_price), 
                          "Volume:", str(self.volume)])
 
-# FIXME: Abstract out caching functionality.
-def get_item_price_overview(session, app_id, market_hash_name, country = "US", currency = 1):
-    # Init cache if it hasn't been yet.
-    if not hasattr(get_item_price_overview, 'PRICE_DATA_CACHE'):
-        get_item_price_overview.PRICE_DATA_CACHE = PriceDataCache(session)
-
-    # See if we've already made the request. If so, return that data.
-    cached_data = get_item_price_overview.PRICE_DATA_CACHE.get_data(app_id, market_hash_name)
-    if cached_data != None:
-        return cached_data
+def __no_price(currency_id):
+    return currency.Money(0, currency.STEAM_CURRENCY_CODES.get(currency_id, 'USD'))
 
-    result = session.requests_session.get('https://steamcommunity.com/market/priceoverview/', params = {
+def __fetch_item_price_overview(session, app_id, market_hash_name, country, currency):
+    result = session.transport.get('priceoverview', 'https://steamcommunity.com/market/priceoverview/', params = {
             'country'  : country,
             'currency' : currency,
             'appid'    : app_id,
@@ -67,52 +252,308 @@ def get_item_price_overview(session, app_id, market_hash_name, country = "US", c
         raise ItemPriceOverviewRetreivalFailure("item_price_overview: Got failure!", 
                 (session, app_id, market_hash_name, country, currency))
 
+    # Steam leaves lowest_price out for items nobody has listed, fall back to what they last sold for.
+    lowest_price = json_dict.get('lowest_price', json_dict.get('median_price'))
+    if lowest_price is None:
+        lowest_price = __no_price(currency)
+
     if ('volume' not in json_dict or
         'median_price' not in json_dict):
-        data = ItemPriceData(json_dict['lowest_price'], 0, "$0.00")
+        data = ItemPriceData(lowest_price, 0)
     else:
-        print(json_dict)
-        data = ItemPriceData(json_dict['lowest_price'], json_dict['volume'], json_dict['median_price'])
+        data = ItemPriceData(lowest_price, json_dict['volume'], json_dict['median_price'])
 
-    get_item_price_overview.PRICE_DATA_CACHE.set_data(app_id, market_hash_name, data)
+    session.price_data_cache.set_data(app_id, market_hash_name, data, currency)
 
     return data
 
-# TODO: Flesh out.
+def __coalesced_fetch_item_price_overview(session, app_id, market_hash_name, country, currency):
+    """ Callers asking for the same price while it is being fetched share that one request. """
+    return session.transport.in_flight.do(('priceoverview', app_id, market_hash_name, country, currency),
+            __fetch_item_price_overview, session, app_id, market_hash_name, country, currency)
+
+def __convertible_code(conversion_table, currency_id):
+    """ The currency code to convert USD prices into, or None if prices in this currency
+        have to be fetched from Steam. """
+    if conversion_table is None or currency_id == 1:
+        return None
+    code = currency.STEAM_CURRENCY_CODES.get(currency_id)
+    if code is None or conversion_table.rate(code) is None:
+        return None
+    return code
+
+def get_item_price_overview(session, app_id, market_hash_name, country = "US", currency = 1,
+                            conversion_table = None):
+    """ Price data of an item in one of Steam's wallet currencies (see currency.STEAM_CURRENCY_CODES).
+        conversion_table - Optional currency.ConversionTable. If it has a rate for the currency,
+                           the USD price is converted instead of asking Steam for this currency. """
+    # See if we've already made the request. If so, return that data.
+    cached_data = session.price_data_cache.get_data(app_id, market_hash_name, currency)
+    if cached_data != None:
+        return cached_data
+
+    code = __convertible_code(conversion_table, currency)
+    if code != None:
+        usd_data = get_item_price_overview(session, app_id, market_hash_name, country, 1)
+        return usd_data.convert(conversion_table, code)
+
+    return __coalesced_fetch_item_price_overview(session, app_id, market_hash_name, country, currency)
+
+def get_item_price_overviews(session, keys, workers = 8, country = "US", currency = 1,
+                             conversion_table = None, errors = None):
+    """ Batched version of get_item_price_overview. 
+        keys    - Iterable of (app_id, market_hash_name) pairs. Duplicates are only looked up once.
+        workers - Maximum number of price requests in flight at the same time.
+        errors  - Optional dict. Failed fetches are recorded in it by key instead of raised,
+                  and the prices that could be fetched are still returned.
+        currency and conversion_table are used like in get_item_price_overview.
+        Returns a dict mapping each (app_id, market_hash_name) pair to its ItemPriceData. 
+        Cached entries are served directly, the rest are fetched concurrently. Without
+        errors, the first failed fetch is raised: fetches that haven't started yet are
+        cancelled, those in flight are waited for, and every result is discarded. """
+    results = {}
+    misses  = []
+    for key in collections.OrderedDict.fromkeys(keys):
+        cached_data = session.price_data_cache.get_data(key[0], key[1], currency)
+        if cached_data != None:
+            results[key] = cached_data
+        else:
+            misses.append(key)
+
+    if not misses:
+        return results
+
+    code = __convertible_code(conversion_table, currency)
+    if code != None:
+        usd_results = get_item_price_overviews(session, misses, workers, country, 1, errors = errors)
+        for key in misses:
+            if key in usd_results:
+                results[key] = usd_results[key].convert(conversion_table, code)
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(misses))) as executor:
+        futures = [executor.submit(__coalesced_fetch_item_price_overview, session, app_id, market_hash_name, country, currency)
+                   for app_id, market_hash_name in misses]
+        for key, future in zip(misses, futures):
+            try:
+                results[key] = future.result()
+            except Exception as error:
+                if errors is None or not isinstance(error, PRICE_LOOKUP_ERRORS):
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                errors[key] = error
+
+    return results
+
+# Liquid items whose prices are sampled in each currency to derive conversion rates.
+CONVERSION_SAMPLE_ITEMS = [
+        (440, 'Mann Co. Supply Crate Key'),
+        (730, 'Chroma 2 Case'),
+        (730, 'Falchion Case'),
+        (730, 'Shadow Case'),
+        (730, 'Operation Breakout Weapon Case')
+]
+
+def refresh_conversion_table(session, conversion_table, currency_ids, sample_items = CONVERSION_SAMPLE_ITEMS,
+                             country = "US", force = False):
+    """ Derives conversion rates from the prices of sample_items in USD and in each of
+        currency_ids (Steam currency IDs). Only stale rates are refreshed unless force is set.
+        The table is saved afterwards if it has a path. Returns the codes that were refreshed. """
+    refreshed = []
+    stale = [currency_id for currency_id in currency_ids
+             if currency_id != 1 and (force or conversion_table.is_stale(currency.STEAM_CURRENCY_CODES[currency_id]))]
+    if not stale:
+        return refreshed
+
+    usd_prices = get_item_price_overviews(session, sample_items, country = country)
+    for currency_id in stale:
+        code   = currency.STEAM_CURRENCY_CODES[currency_id]
+        prices = get_item_price_overviews(session, sample_items, country = country, currency = currency_id)
+        samples = []
+        for key in sample_items:
+            usd_data, data = usd_prices[key], prices[key]
+            # Medians move slower than the lowest listing, prefer them when both are known.
+            if usd_data.median_price and data.median_price:
+                samples.append((usd_data.median_price, data.median_price))
+            else:
+                samples.append((usd_data.low_price, data.low_price))
+        conversion_table.add_samples(code, samples)
+        refreshed.append(code)
+
+    if conversion_table.path != None:
+        conversion_table.save()
+    return refreshed
+
+MONTHS = { 'Jan' : 1, 'Feb' : 2,  'Mar' : 3,  'Apr' : 4,
+           'May' : 5, 'Jun' : 6,  'Jul' : 7,  'Aug' : 8,
+           'Sep' : 9, 'Oct' : 10, 'Nov' : 11, 'Dec' : 12 }
+
+def parse_price_history_date(text):
+    """ Converts a price history date such as 'Dec 06 2013 01: +0' into epoch seconds (UTC). """
+    return calendar.timegm((int(text[7:11]), MONTHS[text[0:3]], int(text[4:6]), int(text[12:14]), 0, 0))
+
 class ItemPriceHistory(object):
-    def __init__(self, json_dict):
-        self.json_dict = json_dict
+    """ Price history of an item stored as three parallel arrays.
+        timestamps - Epoch seconds of each data point, in ascending order.
+        prices     - Median sale price at each point.
+        volumes    - Number of items sold at each point. """
+    def __init__(self, timestamps = None, prices = None, volumes = None):
+        self.timestamps = timestamps if timestamps != None else array.array('q')
+        self.prices     = prices     if prices     != None else array.array('d')
+        self.volumes    = volumes    if volumes    != None else array.array('q')
+
+    @staticmethod
+    def from_json_dict(json_dict):
+        history = ItemPriceHistory()
+        for date, price, volume in json_dict['prices']:
+            history.append(parse_price_history_date(date), price, int(volume.replace(',', '')))
+        return history
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, price, volume):
+        self.timestamps.append(timestamp)
+        self.prices.append(price)
+        self.volumes.append(volume)
+
+    def last_timestamp(self):
+        if not self.timestamps:
+            return None
+        return self.timestamps[-1]
+
+    def extend(self, other):
+        """ Appends the points of other that are newer than our last point. 
+            Returns the number of points appended. """
+        start = 0
+        if self.timestamps:
+            start = bisect.bisect_right(other.timestamps, self.timestamps[-1])
+        self.timestamps.extend(other.timestamps[start:])
+        self.prices.extend(other.prices[start:])
+        self.volumes.extend(other.volumes[start:])
+        return len(other) - start
+
+    def since(self, timestamp):
+        """ Returns a new ItemPriceHistory holding only the points at or after timestamp. """
+        start = bisect.bisect_left(self.timestamps, timestamp)
+        return ItemPriceHistory(self.timestamps[start:], self.prices[start:], self.volumes[start:])
 
 class ItemPriceHistoryRetreivalFailure(RequestFailure):
     pass
 
+class PriceHistoryParser(object):
+    """ Incremental parser of a pricehistory response body. Chunks are fed in as they
+        arrive and each point of the 'prices' array goes straight into an ItemPriceHistory,
+        without building the JSON document. Only the other, small, fields are kept as text,
+        to find 'success' in. """
+    PRICES_START = re.compile(r'"prices"\s*:\s*\[')
+    POINT        = re.compile(r'\s*,?\s*\[\s*"([^"]*)"\s*,\s*([-+0-9.eE]+)\s*,\s*"([0-9,]*)"\s*\]')
+    PRICES_END   = re.compile(r'\s*\]')
+    SUCCESS      = re.compile(r'"success"\s*:\s*(true|false)')
+
+    def __init__(self):
+        self.history  = ItemPriceHistory()
+        self.__text   = ''
+        self.__other  = ''
+        self.__state  = 'before'
+        self.__days   = {}
+        self.__decode = codecs.getincrementaldecoder('utf-8')()
+
+    def __timestamp(self, date):
+        # Points come hourly, so only convert each day once.
+        day = self.__days.get(date[0:11])
+        if day is None:
+            day = calendar.timegm((int(date[7:11]), MONTHS[date[0:3]], int(date[4:6]), 0, 0, 0))
+            self.__days[date[0:11]] = day
+        return day + int(date[12:14]) * 3600
+
+    def feed(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = self.__decode.decode(chunk)
+        self.__text += chunk
+
+        if self.__state == 'before':
+            match = self.PRICES_START.search(self.__text)
+            if match is None:
+                return
+            self.__other += self.__text[:match.start()]
+            self.__text   = self.__text[match.end():]
+            self.__state  = 'prices'
+
+        if self.__state == 'prices':
+            position = 0
+            append = self.history.append
+            while True:
+                end = self.__text.find(']', position)
+                if end < 0:
+                    break
+                match = self.POINT.match(self.__text, position, end + 1)
+                if match != None:
+                    date, price, volume = match.groups()
+                    append(self.__timestamp(date), float(price), int(volume.replace(',', '')))
+                    position = match.end()
+                    continue
+                if self.PRICES_END.match(self.__text, position, end + 1):
+                    position = end + 1
+                    self.__state = 'after'
+                    break
+                raise ValueError("PriceHistoryParser: Malformed point: " + self.__text[position:end + 1])
+            self.__text = self.__text[position:]
+
+        if self.__state == 'after':
+            self.__other += self.__text
+            self.__text   = ''
+
+    def success(self):
+        """ The response's 'success' flag, or None if it didn't have one. """
+        match = self.SUCCESS.search(self.__other + self.__text)
+        if match is None:
+            return None
+        return match.group(1) == 'true'
+
+    def close(self):
+        """ Returns the ItemPriceHistory, raising ValueError if the prices array never ended. """
+        if self.__state == 'prices':
+            raise ValueError("PriceHistoryParser: Response ended inside the prices array.")
+        return self.history
+
 # XXX: Use with caution, this returns about 50KB worth of data per call.
-# Probably call this once and store in a database and periodically refresh.
-def get_item_price_history(session, app_id, market_hash_name):
-    result = session.requests_session.get('https://steamcommunity.com/market/pricehistory/', params = {
+# Prefer history.PriceHistoryStore, which keeps the result locally and only appends new points.
+def get_item_price_history(session, app_id, market_hash_name, chunk_size = 16 * 1024):
+    """ Fetches an item's price history, parsing the response while it streams in. """
+    result = session.transport.get('pricehistory', 'https://steamcommunity.com/market/pricehistory/', params = {
                 'appid' : app_id,
                 # FIXME: In the javascript for this endpoint, it defaults to the 'market_name' if 'market_hash_name' is undefined...
-                'market_hash_name' : market_hash_name})
+                'market_hash_name' : market_hash_name}, stream = True)
 
-    json_dict = result.json()
+    parser = PriceHistoryParser()
+    try:
+        for chunk in result.iter_content(chunk_size = chunk_size):
+            parser.feed(chunk)
+    finally:
+        result.close()
 
-    if not json_dict['success']: 
+    if not parser.success():
         raise ItemPriceHistoryRetreivalFailure("get_item_price_history: Got failure response!",
                 (session, app_id, market_hash_name))
 
-    return ItemPriceHistory(json_dict) 
+    return parser.close()
 
 class ItemSaleError(RequestFailure):
     pass
 
-def post_item_for_sale(session, item, price_in_cents):
-    """ price_in_cents - The price (before fees!) to post the item at. """
+def __sale_request_state(session):
+    """ The headers and session ID shared by every sell request of a session. """
     headers = {
             'Referer'    : 'https://steamcommunity.com/profiles/' + str(session.profile_id()) + '/inventory',
             'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2062.120 Safari/537.36'
     }
     session_id = copy.deepcopy(session.requests_session.cookies['sessionid'])
     session_id = urllib.parse.unquote(session_id)
+    return (headers, session_id)
+
+def __post_item_for_sale(session, item, price_in_cents, headers, session_id):
     payload = { 'sessionid' : session_id,
                 'appid'     : int(item.app_id()),
                 'contextid' : 2, # TODO: Why is this 2? Is that inventory context?
@@ -120,15 +561,73 @@ def post_item_for_sale(session, item, price_in_cents):
                 'amount'    : 1, # TODO: Is this ever not 1?
                 'price'     : price_in_cents}
 
-    result = session.requests_session.post('https://steamcommunity.com/market/sellitem/', headers = headers, data = payload)
+    result = session.transport.post('sellitem', 'https://steamcommunity.com/market/sellitem/', headers = headers, data = payload)
 
     if result.status_code != 200:
-        pdb.set_trace()
         raise ItemSaleError("post_item_for_sale: Item sale request error!",
                 (session, item, price_in_cents, result))
 
     return result
 
+def post_item_for_sale(session, item, price_in_cents):
+    """ price_in_cents - The price (before fees!) to post the item at. """
+    headers, session_id = __sale_request_state(session)
+    return __post_item_for_sale(session, item, price_in_cents, headers, session_id)
+
+class ItemSaleSummary(object):
+    def __init__(self):
+        self.posted = {}
+        self.failed = {}
+
+    def __str__(self):
+        return " ".join(["Posted:", str(len(self.posted)),
+                         "Failed:", str(len(self.failed))])
+
+def post_items_for_sale(session, sales, workers = 2, progress = None):
+    """ Posts many items for sale concurrently. Requests still queue on the 'sellitem'
+        rate limit, so extra workers mostly hide the latency of each request.
+        sales    - Iterable of (item, price_in_cents) pairs. Prices are before fees, 
+                   like post_item_for_sale.
+        workers  - Maximum number of sell requests in flight at the same time.
+        progress - Optional function called as progress(item, error, done, total) each
+                   time an item is finished. error is None if it was posted.
+                   Called from the worker threads, one call at a time.
+        Returns an ItemSaleSummary whose posted and failed dicts are keyed by the item's 
+        asset ID and hold the response or the error respectively. """
+    # Log back in now if we have to, rather than failing every sale of the batch.
+    session.ensure_valid()
+    sales   = list(sales)
+    summary = ItemSaleSummary()
+    lock    = threading.Lock()
+    done    = [0]
+
+    if not sales:
+        return summary
+
+    headers, session_id = __sale_request_state(session)
+
+    def post(item, price_in_cents):
+        try:
+            result = __post_item_for_sale(session, item, price_in_cents, headers, session_id)
+            error = None
+        except (ItemSaleError, requests.RequestException) as sale_error:
+            error = sale_error
+
+        with lock:
+            if error is None:
+                summary.posted[item.id()] = result
+            else:
+                summary.failed[item.id()] = error
+            done[0] += 1
+            if progress != None:
+                progress(item, error, done[0], len(sales))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(sales))) as executor:
+        for future in [executor.submit(post, item, price_in_cents) for item, price_in_cents in sales]:
+            future.result()
+
+    return summary
+
 class MarketListing(object):
     def __init__(self, listing_id, item_name, item_link, game_name):
         self.id         = listing_id
@@ -139,12 +638,7 @@ class MarketListing(object):
     def __str__(self):
         return "".join(["[", str(self.id), "]: ", self.item_name])
 
-def get_current_listings(session):
-    page = session.requests_session.get('https://steamcommunity.com/market/')
-    tree = html.fromstring(page.text)
-    listing_divs = tree.xpath('//div[@class="market_listing_item_name_block"]') 
-
-    listings = []
+def __parse_listing_divs(listing_divs):
     for div in listing_divs:
         name_id = div[0].attrib['id']
         listing_id = re.search("(\d+)", name_id).group(1)
@@ -157,24 +651,61 @@ def get_current_listings(session):
         item_link = item_anchor.attrib['href']
         item_name = item_anchor.text
         game_name = div[2].text
-        listings.append(MarketListing(listing_id, item_name, item_link, game_name))
+        yield MarketListing(listing_id, item_name, item_link, game_name)
+
+LISTING_NAME_BLOCK_XPATH = '//div[@class="market_listing_item_name_block"]'
+
+def get_current_listings(session):
+    """ Scrapes the listings shown on the /market/ page. Only sees the first page of 
+        listings, see iter_current_listings for the complete set. """
+    page = session.transport.get('mylistings', 'https://steamcommunity.com/market/')
+    tree = html.fromstring(page.text)
+    listing_divs = tree.xpath(LISTING_NAME_BLOCK_XPATH) 
+
+    return list(__parse_listing_divs(listing_divs))
+
+class ListingRetrievalError(RequestFailure):
+    pass
 
-    return listings
+def iter_current_listings(session, page_size = 100):
+    """ Generator over all of the user's active market listings.
+        Pages through the market's JSON render endpoint page_size listings at a time, 
+        only parsing the HTML fragment of each page. Don't remove listings while iterating,
+        since that shifts the pages; collect them into a list first. """
+    session.ensure_valid()
+    start = 0
+    while True:
+        result = session.transport.get('mylistings', 'https://steamcommunity.com/market/mylistings/render/',
+                params = { 'start' : start, 'count' : page_size })
+        json_dict = result.json()
+
+        if not json_dict or not json_dict['success']:
+            raise ListingRetrievalError("iter_current_listings: Got failure response!",
+                    (session, start, page_size, result))
+
+        results_html = json_dict['results_html'].strip()
+        if not results_html:
+            return
+
+        fragment = html.fragment_fromstring(results_html, create_parent = 'div')
+        for listing in __parse_listing_divs(fragment.xpath('.' + LISTING_NAME_BLOCK_XPATH)):
+            yield listing
+
+        start += int(json_dict.get('pagesize', page_size))
+        if start >= int(json_dict['total_count']):
+            return
 
 class ListingRemovalError(RequestFailure):
     pass
 
-def remove_listing(session, listing_id):
-    headers = {
-            'referer'    : 'https://steamcommunity.com/market/',
-            'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2062.120 Safari/537.36'
-    }
+REMOVE_LISTING_HEADERS = {
+        'referer'    : 'https://steamcommunity.com/market/',
+        'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/37.0.2062.120 Safari/537.36'
+}
 
-    session_id = copy.deepcopy(session.requests_session.cookies['sessionid'])
-    session_id = urllib.parse.unquote(session_id)
-    payload = { 'sessionid' : session_id }
-    result = session.requests_session.post('https://steamcommunity.com/market/removelisting/' + str(listing_id), 
-                headers = headers, data = payload)
+def __remove_listing(session, listing_id, payload):
+    result = session.transport.post('removelisting', 'https://steamcommunity.com/market/removelisting/' + str(listing_id),
+                headers = REMOVE_LISTING_HEADERS, data = payload)
 
     if result.status_code != 200:
         raise ListingRemovalError("remove_listing: Failed to remove listing.",
@@ -182,6 +713,77 @@ def remove_listing(session, listing_id):
 
     return result
 
+def remove_listing(session, listing_id):
+    session_id = copy.deepcopy(session.requests_session.cookies['sessionid'])
+    session_id = urllib.parse.unquote(session_id)
+    return __remove_listing(session, listing_id, { 'sessionid' : session_id })
+
+class ListingRemovalSummary(object):
+    def __init__(self):
+        self.removed = []
+        self.failed  = {}
+        self.retried = []
+
+    def __str__(self):
+        return " ".join(["Removed:", str(len(self.removed)),
+                         "Failed:",  str(len(self.failed)),
+                         "Retried:", str(len(self.retried))])
+
+def remove_listings(session, listing_ids, workers = 4, progress = None, max_retries = 1):
+    """ Removes many listings concurrently. Requests still queue on the 'removelisting'
+        rate limit, so extra workers mostly hide the latency of each request.
+        listing_ids - Iterable of listing IDs. Duplicates are only removed once.
+        workers     - Maximum number of removal requests in flight at the same time.
+        progress    - Optional function called as progress(listing_id, error, done, total) 
+                      each time a listing is finished. error is None if it was removed.
+                      Called from the worker threads, one call at a time.
+        max_retries - How many more times a failed removal is attempted.
+        Returns a ListingRemovalSummary. A failure never stops the other removals, it is 
+        recorded in the summary's failed dict keyed by listing ID. """
+    session.ensure_valid()
+    listing_ids = list(collections.OrderedDict.fromkeys(listing_ids))
+    summary     = ListingRemovalSummary()
+    lock        = threading.Lock()
+    done        = [0]
+
+    session_id = copy.deepcopy(session.requests_session.cookies['sessionid'])
+    payload = { 'sessionid' : urllib.parse.unquote(session_id) }
+
+    def remove(listing_id):
+        error = None
+        attempt = 0
+        while True:
+            try:
+                __remove_listing(session, listing_id, payload)
+                error = None
+                break
+            except (ListingRemovalError, requests.RequestException) as removal_error:
+                error = removal_error
+                if attempt >= max_retries:
+                    break
+                if attempt == 0:
+                    with lock:
+                        summary.retried.append(listing_id)
+                attempt += 1
+
+        with lock:
+            if error is None:
+                summary.removed.append(listing_id)
+            else:
+                summary.failed[listing_id] = error
+            done[0] += 1
+            if progress != None:
+                progress(listing_id, error, done[0], len(listing_ids))
+
+    if not listing_ids:
+        return summary
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(listing_ids))) as executor:
+        for future in [executor.submit(remove, listing_id) for listing_id in listing_ids]:
+            future.result()
+
+    return summary
+
 WALLET_MINIMUM_FEE    = 1
 WALLET_BASE_FEE       = 0
 PUBLISHER_MINIMUM_FEE = 1
@@ -191,7 +793,7 @@ def get_desired_price(total_price_in_cents,
         publisher_fee_percent = 0.10):
     """ Get the desired list price to achieve the total_price_cents """
     desired_price = math.ceil(total_price_in_cents / (1 + steam_fee_percent + publisher_fee_percent))
-    steam_fee, publisher_fee = calculate_fees(desired_price)
+    steam_fee, publisher_fee = calculate_fees(desired_price, steam_fee_percent, publisher_fee_percent)
 
     calculated_total = desired_price + steam_fee + publisher_fee
 
@@ -221,6 +823,59 @@ def calculate_fees(price_in_cents,
 
     return (steam_fee, publisher_fee)
 
+def calculate_fees_array(prices_in_cents,
+        steam_fee_percent = 0.05,
+        publisher_fee_percent = 0.10):
+    """ calculate_fees over a whole array of prices at once.
+        prices_in_cents - A NumPy array, or any buffer or sequence of integer cent values.
+        Returns a (steam_fees, publisher_fees) pair of int64 NumPy arrays. Without NumPy
+        installed this falls back to calculate_fees and returns array.array('q')s instead. """
+    if numpy is None:
+        steam_fees     = array.array('q')
+        publisher_fees = array.array('q')
+        for price in prices_in_cents:
+            steam_fee, publisher_fee = calculate_fees(price, steam_fee_percent, publisher_fee_percent)
+            steam_fees.append(steam_fee)
+            publisher_fees.append(publisher_fee)
+        return (steam_fees, publisher_fees)
+
+    prices = numpy.asarray(prices_in_cents, dtype = numpy.int64)
+    steam_fees = numpy.floor(numpy.maximum(prices * steam_fee_percent, 
+                                           WALLET_MINIMUM_FEE)
+                             + WALLET_BASE_FEE).astype(numpy.int64)
+    if publisher_fee_percent > 0.0:
+        publisher_fees = numpy.floor(numpy.maximum(prices * publisher_fee_percent,
+                                                   PUBLISHER_MINIMUM_FEE)).astype(numpy.int64)
+    else:
+        publisher_fees = numpy.zeros_like(prices)
+
+    return (steam_fees, publisher_fees)
+
+def get_desired_prices(total_prices_in_cents,
+        steam_fee_percent = 0.05,
+        publisher_fee_percent = 0.10):
+    """ get_desired_price over a whole array of total prices at once.
+        Takes and returns the same kinds of arrays as calculate_fees_array. """
+    if numpy is None:
+        return array.array('q', [get_desired_price(total, steam_fee_percent, publisher_fee_percent)
+                                 for total in total_prices_in_cents])
+
+    totals = numpy.asarray(total_prices_in_cents, dtype = numpy.int64)
+    desired_prices = numpy.ceil(totals / (1 + steam_fee_percent + publisher_fee_percent)).astype(numpy.int64)
+    steam_fees, publisher_fees = calculate_fees_array(desired_prices, steam_fee_percent, publisher_fee_percent)
+
+    differences = totals - (desired_prices + steam_fees + publisher_fees)
+
+    if (differences > 1).any():
+        raise Exception("get_desired_prices: Could not properly calculate the desired amount! Difference: " + 
+                        str(differences[differences > 1][0]))
+
+    # Same cases as get_desired_price: exact, off by one, or one or more fees too small.
+    return numpy.where(differences == 0, desired_prices,
+           numpy.where(differences == 1, desired_prices + 1,
+                       totals - numpy.maximum(steam_fees, WALLET_MINIMUM_FEE)
+                              - numpy.maximum(publisher_fees, PUBLISHER_MINIMUM_FEE)))
+
 class TestDesiredPriceFunction(unittest.TestCase):
     def test_desired_price_calculation(self):
         """ Tests that we can extract the desired price from the total price 
@@ -231,6 +886,6 @@ class TestDesiredPriceFunction(unittest.TestCase):
             total_price = desired_price + steam_fee + publisher_fee
             calculated_desired_price = get_desired_price(total_price)
             self.assertEqual(desired_price, calculated_desired_price)
-            
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,138 @@
+import concurrent.futures
+import contextlib
+import threading
+
+import requests
+
+from desperado import auth
+
+
+def configure_connection_pool(session, pool_connections = 10, pool_maxsize = 32):
+    """ Mounts HTTP adapters on a Session's requests.Session that keep up to pool_maxsize
+        connections alive per host, so concurrent workers reuse connections instead of
+        doing a TLS handshake each.
+        pool_connections - Number of hosts to keep connection pools for.
+        pool_maxsize     - Connections kept per host. Should be at least the number of
+                           workers sharing the session. """
+    adapter = requests.adapters.HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+    session.requests_session.mount('https://', adapter)
+    session.requests_session.mount('http://', adapter)
+    return session
+
+class PoolExhausted(Exception):
+    def __init__(self, reason, family):
+        self.reason = reason
+        self.family = family
+
+class SessionPool(object):
+    """ Several logged in accounts that work is spread across.
+        checkout() hands out the session whose rate limit for an endpoint family would let
+        a request through soonest, so throughput grows with the number of accounts.
+        max_checkouts    - How many workers may hold the same session at once.
+        pool_connections - See configure_connection_pool.
+        pool_maxsize     - See configure_connection_pool. Defaults to max_checkouts, plus
+                           a few connections for requests made outside of checkouts. """
+    def __init__(self, sessions = (), max_checkouts = 4, pool_connections = 10, pool_maxsize = None):
+        self.max_checkouts    = max_checkouts
+        self.pool_connections = pool_connections
+        self.pool_maxsize     = pool_maxsize if pool_maxsize != None else max_checkouts + 4
+        self.__condition      = threading.Condition()
+        self.__sessions       = []
+        self.__checkouts      = {}
+        self.__last_checkout  = {}
+        self.__checkout_count = 0
+        for session in sessions:
+            self.add(session)
+
+    def add(self, session):
+        configure_connection_pool(session, self.pool_connections, self.pool_maxsize)
+        with self.__condition:
+            self.__sessions.append(session)
+            self.__checkouts[id(session)]     = 0
+            self.__last_checkout[id(session)] = 0
+            self.__condition.notify_all()
+        return session
+
+    def add_account(self, username, password, **login_arguments):
+        """ Logs an account in with auth.login and adds its session. """
+        return self.add(auth.login(username, password, **login_arguments))
+
+    def sessions(self):
+        with self.__condition:
+            return list(self.__sessions)
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def __delay(self, session, family):
+        bucket = session.transport.buckets.get(family)
+        if bucket is None:
+            return 0.0
+        return bucket.delay()
+
+    def __pick(self, family):
+        available = [session for session in self.__sessions
+                     if self.__checkouts[id(session)] < self.max_checkouts]
+        if not available:
+            return None
+        # Soonest rate limit first, then the least busy, then the one that waited longest.
+        return min(available, key = lambda session: (self.__delay(session, family),
+                                                     self.__checkouts[id(session)],
+                                                     self.__last_checkout[id(session)]))
+
+    def checkout(self, family, timeout = None):
+        """ Takes the best session for a request of the given endpoint family, waiting for
+            one to be checked in if they're all at max_checkouts. The session is made valid
+            (see auth.Session.ensure_valid) before it's handed out.
+            Raises PoolExhausted if none became available within timeout seconds. """
+        with self.__condition:
+            if not self.__sessions:
+                raise PoolExhausted("SessionPool.checkout: The pool has no sessions.", family)
+            session = self.__pick(family)
+            if session is None and self.__condition.wait_for(lambda: self.__pick(family) != None, timeout):
+                session = self.__pick(family)
+            if session is None:
+                raise PoolExhausted("SessionPool.checkout: Timed out waiting for a session.", family)
+            self.__checkout_count += 1
+            self.__checkouts[id(session)]    += 1
+            self.__last_checkout[id(session)] = self.__checkout_count
+
+        try:
+            session.ensure_valid()
+        except Exception:
+            self.checkin(session)
+            raise
+        return session
+
+    def checkin(self, session):
+        with self.__condition:
+            self.__checkouts[id(session)] -= 1
+            self.__condition.notify()
+
+    @contextlib.contextmanager
+    def session(self, family, timeout = None):
+        """ checkout() as a context manager that checks the session back in. """
+        session = self.checkout(family, timeout)
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+    def map(self, family, function, items, workers = None):
+        """ Calls function(session, item) for every item, concurrently, each call with a
+            session checked out for the given endpoint family. Returns the results in the
+            order of items. If any call fails, its exception is raised once the others finish.
+            workers - Defaults to enough to check every session out max_checkouts times. """
+        items = list(items)
+        if not items:
+            return []
+        if workers is None:
+            workers = max(1, len(self) * self.max_checkouts)
+
+        def call(item):
+            with self.session(family) as session:
+                return function(session, item)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(items))) as executor:
+            futures = [executor.submit(call, item) for item in items]
+            return [future.result() for future in futures]
@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+
+from desperado import inventory
+from desperado import storage
+
+
+# Layout of a snapshot file. Every integer is little-endian.
+#
+#   header
+#   assets        - ASSET_RECORD for each item, in inventory order.
+#   descriptions  - DESCRIPTION_RECORD for each distinct description.
+#   tags          - TAG_RECORD for each tag, grouped by description.
+#   string index  - (string_count + 1) uint32 offsets into the string data.
+#   string data   - Every distinct string, utf-8 encoded, back to back.
+MAGIC   = b'DSNP'
+VERSION = 1
+
+HEADER             = struct.Struct('<4sHHiiIIIIIQQQQQ')
+ASSET_RECORD       = struct.Struct('<QQQII')
+DESCRIPTION_RECORD = struct.Struct('<QQIIIIIB3x')
+TAG_RECORD         = struct.Struct('<II')
+STRING_OFFSET      = struct.Struct('<I')
+
+NO_STRING = 0xFFFFFFFF
+NO_ID     = -1
+
+class SnapshotError(Exception):
+    def __init__(self, reason, path):
+        self.reason = reason
+        self.path   = path
+
+class _StringTable(object):
+    def __init__(self):
+        self.indexes = {}
+        self.strings = []
+
+    def add(self, text):
+        if text is None:
+            return NO_STRING
+        index = self.indexes.get(text)
+        if index is None:
+            index = len(self.strings)
+            self.indexes[text] = index
+            self.strings.append(text.encode('utf-8'))
+        return index
+
+def save_snapshot(inv, path):
+    """ Writes an Inventory to path in the binary snapshot format, atomically replacing
+        any earlier snapshot. Descriptions and strings are only stored once. """
+    strings          = _StringTable()
+    description_keys = {}
+    descriptions     = []
+    tags             = []
+    assets           = []
+
+    profile_id = strings.add(None if inv.profile_id is None else str(inv.profile_id))
+
+    for item in inv.items:
+        description = item.description
+        key = (description.app_id, description.class_id, description.instance_id)
+        description_index = description_keys.get(key)
+        if description_index is None:
+            description_index = len(descriptions)
+            description_keys[key] = description_index
+            first_tag = len(tags)
+            for category, name in description.tags.items():
+                tags.append(TAG_RECORD.pack(strings.add(category), strings.add(name)))
+            descriptions.append(DESCRIPTION_RECORD.pack(
+                    description.class_id, description.instance_id, description.app_id,
+                    strings.add(description.market_name), strings.add(description.market_hash_name),
+                    first_tag, len(tags) - first_tag, 1 if description.tradable else 0))
+        assets.append(ASSET_RECORD.pack(item.id(), item.class_id(), item.instance_id(),
+                                        item.amount(), description_index))
+
+    string_offsets = [0]
+    for encoded in strings.strings:
+        string_offsets.append(string_offsets[-1] + len(encoded))
+
+    asset_offset        = HEADER.size
+    description_offset  = asset_offset + len(assets) * ASSET_RECORD.size
+    tag_offset          = description_offset + len(descriptions) * DESCRIPTION_RECORD.size
+    string_index_offset = tag_offset + len(tags) * TAG_RECORD.size
+    string_data_offset  = string_index_offset + len(string_offsets) * STRING_OFFSET.size
+
+    header = HEADER.pack(MAGIC, VERSION, 0,
+                         NO_ID if inv.app_id is None else int(inv.app_id),
+                         NO_ID if inv.context_id is None else int(inv.context_id),
+                         profile_id, len(assets), len(descriptions), len(tags), len(strings.strings),
+                         asset_offset, description_offset, tag_offset, string_index_offset, string_data_offset)
+
+    with storage.atomic_write(path, 'wb') as outfile:
+        outfile.write(header)
+        outfile.write(b''.join(assets))
+        outfile.write(b''.join(descriptions))
+        outfile.write(b''.join(tags))
+        outfile.write(b''.join(STRING_OFFSET.pack(offset) for offset in string_offsets))
+        outfile.write(b''.join(strings.strings))
+
+class InventorySnapshot(object):
+    """ Read-only view of a snapshot file through mmap. Nothing is decoded up front:
+        strings, descriptions and items are only built when they are asked for, and
+        where() decides which assets match by looking at the (deduplicated) descriptions
+        before building any items.
+        catalog - Optional catalog.DescriptionCatalog. Descriptions it already knows are
+                  taken from it instead of being decoded from the file.
+        Use as a context manager, or call close() when done. """
+    def __init__(self, path, catalog = None):
+        self.path    = path
+        self.catalog = catalog
+        if os.path.getsize(path) < HEADER.size:
+            raise SnapshotError("InventorySnapshot: File is too short to be a snapshot!", path)
+        with open(path, 'rb') as infile:
+            self.__map = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+
+        (magic, version, flags, app_id, context_id, profile_id,
+         self.asset_count, self.description_count, self.tag_count, self.string_count,
+         self.__asset_offset, self.__description_offset, self.__tag_offset,
+         self.__string_index_offset, self.__string_data_offset) = HEADER.unpack_from(self.__map, 0)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise SnapshotError("InventorySnapshot: Not a version " + str(VERSION) + " snapshot!", path)
+        try:
+            self.__check_sections()
+        except SnapshotError:
+            self.close()
+            raise
+
+        self.app_id       = None if app_id == NO_ID else app_id
+        self.context_id   = None if context_id == NO_ID else context_id
+        self.__strings      = {}
+        self.__descriptions = [None] * self.description_count
+        self.profile_id   = self.string(profile_id)
+
+    def __check_section(self, name, offset, size):
+        if offset < HEADER.size or offset + size > len(self.__map):
+            raise SnapshotError("InventorySnapshot: The " + name + " section lies outside the file, it's truncated or corrupt!",
+                                self.path)
+
+    def __check_sections(self):
+        """ Makes sure every record the header promises is inside the file, so that reading
+            them later can't run off its end. """
+        self.__check_section('asset', self.__asset_offset, self.asset_count * ASSET_RECORD.size)
+        self.__check_section('description', self.__description_offset, self.description_count * DESCRIPTION_RECORD.size)
+        self.__check_section('tag', self.__tag_offset, self.tag_count * TAG_RECORD.size)
+        self.__check_section('string index', self.__string_index_offset, (self.string_count + 1) * STRING_OFFSET.size)
+        string_data_size, = STRING_OFFSET.unpack_from(self.__map, self.__string_index_offset + self.string_count * STRING_OFFSET.size)
+        self.__check_section('string data', self.__string_data_offset, string_data_size)
+
+    def __corrupt(self, what):
+        return SnapshotError("InventorySnapshot: " + what + ", the snapshot is corrupt!", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.__map.close()
+
+    def __len__(self):
+        return self.asset_count
+
+    def string(self, index):
+        if index == NO_STRING:
+            return None
+        text = self.__strings.get(index)
+        if text is None:
+            if not 0 <= index < self.string_count:
+                raise self.__corrupt("String " + str(index) + " doesn't exist")
+            start, end = struct.unpack_from('<II', self.__map, self.__string_index_offset + index * STRING_OFFSET.size)
+            try:
+                text = self.__map[self.__string_data_offset + start:self.__string_data_offset + end].decode('utf-8')
+            except UnicodeDecodeError:
+                raise self.__corrupt("String " + str(index) + " isn't utf-8")
+            self.__strings[index] = text
+        return text
+
+    def asset(self, index):
+        """ The raw (asset_id, class_id, instance_id, amount, description_index) record of an item. """
+        return ASSET_RECORD.unpack_from(self.__map, self.__asset_offset + index * ASSET_RECORD.size)
+
+    def __description_record(self, index):
+        return DESCRIPTION_RECORD.unpack_from(self.__map, self.__description_offset + index * DESCRIPTION_RECORD.size)
+
+    def __tags(self, first_tag, tag_count):
+        if first_tag + tag_count > self.tag_count:
+            raise self.__corrupt("Tags " + str(first_tag) + "+" + str(tag_count) + " don't exist")
+        tags = {}
+        for index in range(first_tag, first_tag + tag_count):
+            category, name = TAG_RECORD.unpack_from(self.__map, self.__tag_offset + index * TAG_RECORD.size)
+            tags[self.string(category)] = self.string(name)
+        return tags
+
+    def description(self, index):
+        """ The ItemDescription at index, built on first use and shared afterwards. """
+        if not 0 <= index < self.description_count:
+            raise self.__corrupt("Description " + str(index) + " doesn't exist")
+        description = self.__descriptions[index]
+        if description is None:
+            (class_id, instance_id, app_id, market_name, market_hash_name,
+             first_tag, tag_count, tradable) = self.__description_record(index)
+            if self.catalog != None:
+                description = self.catalog.get(app_id, class_id, instance_id, bool(tradable))
+                if description != None:
+                    self.__descriptions[index] = description
+                    return description
+            description = inventory.ItemDescription({
+                    'appid'            : app_id,
+                    'classid'          : class_id,
+                    'instanceid'       : instance_id,
+                    'market_name'      : self.string(market_name),
+                    'market_hash_name' : self.string(market_hash_name),
+                    'tradable'         : tradable,
+                    'tags'             : [{ 'category' : category, 'name' : name }
+                                          for category, name in self.__tags(first_tag, tag_count).items()] })
+            if self.catalog != None:
+                description = self.catalog.add(description)
+            self.__descriptions[index] = description
+        return description
+
+    def item(self, index):
+        asset_id, class_id, instance_id, amount, description_index = self.asset(index)
+        return inventory.InventoryItem(asset_id, class_id, instance_id, amount, self.description(description_index))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.asset_count
+        if not 0 <= index < self.asset_count:
+            raise IndexError(index)
+        return self.item(index)
+
+    def __iter__(self):
+        for index in range(self.asset_count):
+            yield self.item(index)
+
+    def __description_matches(self, index, criteria):
+        (class_id, instance_id, app_id, market_name, market_hash_name,
+         first_tag, tag_count, tradable) = self.__description_record(index)
+        tags = None
+        for field, value in criteria.items():
+            if field == 'tradable':
+                if bool(tradable) != bool(value):
+                    return False
+            elif field == 'market_hash_name':
+                if self.string(market_hash_name) != value:
+                    return False
+            else:
+                if tags is None:
+                    tags = self.__tags(first_tag, tag_count)
+                if field.endswith('__contains'):
+                    tag_value = tags.get(field[:-len('__contains')])
+                    if tag_value is None or value.lower() not in tag_value.lower():
+                        return False
+                elif '__' in field:
+                    raise ValueError("InventorySnapshot.where: Unsupported lookup '" + field + "'")
+                elif tags.get(field) != value:
+                    return False
+        return True
+
+    def where(self, **criteria):
+        """ Generator over the items matching every criterion, in inventory order.
+            Takes the same criteria as Inventory.where. """
+        matching = set(index for index in range(self.description_count)
+                       if self.__description_matches(index, criteria))
+        if not matching:
+            return
+        assets = self.__map[self.__asset_offset:self.__asset_offset + self.asset_count * ASSET_RECORD.size]
+        for asset_id, class_id, instance_id, amount, description_index in ASSET_RECORD.iter_unpack(assets):
+            if description_index in matching:
+                yield inventory.InventoryItem(asset_id, class_id, instance_id, amount,
+                                              self.description(description_index))
+
+    def to_inventory(self):
+        """ Builds the whole Inventory. """
+        return inventory.Inventory(self.profile_id, list(self), self.app_id, self.context_id)
+
+def load_snapshot(path, catalog = None):
+    """ Reads a whole snapshot back into an Inventory. """
+    with InventorySnapshot(path, catalog) as snapshot:
+        inv = snapshot.to_inventory()
+    if catalog != None:
+        catalog.flush()
+    return inv
@@ -0,0 +1,45 @@
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+class ThreadConnections(object):
+    """ One connection per thread to an SQLite database in WAL mode, so readers don't wait
+        on the writer and no thread has to share its connection.
+        path    - The database file.
+        timeout - Seconds to wait on a database locked by another writer. """
+    def __init__(self, path, timeout = 30.0):
+        self.path    = path
+        self.timeout = timeout
+        self.__local = threading.local()
+
+    def get(self):
+        """ The calling thread's connection, opened on first use. """
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout = self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+        return connection
+
+@contextlib.contextmanager
+def atomic_write(path, mode = 'w'):
+    """ Yields a temporary file next to path to write to, and moves it over path once the
+        block is done, so readers only ever see the old or the new contents. If the block
+        fails the temporary file is removed and path is left alone. Like any temporary
+        file, the result is only readable by its owner. """
+    directory = os.path.dirname(os.path.abspath(path))
+    outfile = tempfile.NamedTemporaryFile(mode, dir = directory, delete = False)
+    try:
+        with outfile:
+            yield outfile
+        os.replace(outfile.name, path)
+    except BaseException:
+        try:
+            os.remove(outfile.name)
+        except OSError:
+            pass
+        raise
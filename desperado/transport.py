@@ -0,0 +1,187 @@
+import email.utils
+import threading
+import time
+
+
+# Sustained requests per second and burst size allowed for each family of Steam endpoints.
+# Families that aren't listed here are not throttled.
+RATE_LIMITS = {
+        'priceoverview' : { 'rate' : 20 / 60.0, 'burst' : 5 },
+        'pricehistory'  : { 'rate' : 20 / 60.0, 'burst' : 2 },
+        'inventory'     : { 'rate' : 10 / 60.0, 'burst' : 2 },
+        'mylistings'    : { 'rate' : 20 / 60.0, 'burst' : 2 },
+        'sellitem'      : { 'rate' : 1.0,       'burst' : 1 },
+        'removelisting' : { 'rate' : 1.0,       'burst' : 1 },
+        'community'     : { 'rate' : 1.0,       'burst' : 5 },
+        'login'         : { 'rate' : 0.5,       'burst' : 2 }
+}
+
+class TokenBucket(object):
+    """ Token bucket that hands out one token per request.
+        rate  - Tokens added per second.
+        burst - Maximum number of tokens the bucket holds.
+        Callers that find the bucket empty take a reservation on a future token and
+        sleep until it is due, so waiting callers are served in the order they arrived.
+        drain() pushes reservations that are still being waited on back as well. """
+    def __init__(self, rate, burst = 1, clock = time.monotonic, sleep = time.sleep):
+        self.rate     = float(rate)
+        self.burst    = burst
+        self.__clock  = clock
+        self.__sleep  = sleep
+        self.__lock   = threading.Lock()
+        self.__tokens = float(burst)
+        self.__last   = clock()
+        # Total seconds drain() has pushed pending reservations back by.
+        self.__pushed_back = 0.0
+
+    def __refill(self):
+        now = self.__clock()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last   = now
+
+    def delay(self):
+        """ Seconds a request made now would have to wait for its token. """
+        with self.__lock:
+            self.__refill()
+            if self.__tokens >= 1:
+                return 0.0
+            return (1 - self.__tokens) / self.rate
+
+    def __reserve(self):
+        """ reserve(), plus how far reservations had been pushed back when this one was taken. """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.0, self.__pushed_back
+            return -self.__tokens / self.rate, self.__pushed_back
+
+    def reserve(self):
+        """ Takes a token, going into debt if none are available.
+            Returns the number of seconds to wait before the token may be used. """
+        return self.__reserve()[0]
+
+    def acquire(self):
+        """ Takes a token, sleeping until it is due. Returns the number of seconds slept. """
+        wait, pushed_back = self.__reserve()
+        waited = 0.0
+        while wait > 0:
+            self.__sleep(wait)
+            waited += wait
+            # Sleep on if the bucket was drained while we were waiting.
+            with self.__lock:
+                wait        = self.__pushed_back - pushed_back
+                pushed_back = self.__pushed_back
+        return waited
+
+    def drain(self, seconds):
+        """ Empties the bucket so that the next token is not handed out for the given number of seconds.
+            Reservations already handed out are moved back by as much, keeping their spacing.
+            Used when Steam tells us we're going too fast anyway. """
+        with self.__lock:
+            self.__refill()
+            if self.__tokens < 0:
+                # Reservations are pending, they keep their place in line, only later.
+                self.__tokens -= seconds * self.rate
+            else:
+                self.__tokens = 1 - seconds * self.rate
+            self.__pushed_back += seconds
+
+class _InFlightCall(object):
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share a key, so only the first caller does the work
+        and everyone who arrives while it's running waits for and shares its result (or error). """
+    def __init__(self):
+        self.__lock  = threading.Lock()
+        self.__calls = {}
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def do(self, key, function, *args, **kwargs):
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self.__calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error != None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            # Even KeyboardInterrupt and the like, or the waiting callers would get None.
+            call.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+class Transport(object):
+    """ Sends every request for a session through the token bucket of its endpoint family.
+        requests_session - The requests.Session to send requests with.
+        rate_limits      - Dict of family name to { 'rate' : ..., 'burst' : ... }.
+                           Defaults to RATE_LIMITS.
+        max_retries      - How many times a throttled (HTTP 429) request is retried.
+        backoff          - Seconds to back off for after the first 429, doubled on every
+                           following retry unless Steam sends Retry-After. The throttled
+                           caller sleeps that long before retrying, and the family's bucket
+                           is drained for as long so every other caller backs off too.
+        sleep            - Function the throttled caller sleeps with. """
+    def __init__(self, requests_session, rate_limits = None, max_retries = 3, backoff = 10.0,
+                 sleep = time.sleep):
+        if rate_limits == None:
+            rate_limits = RATE_LIMITS
+        self.requests_session = requests_session
+        self.max_retries      = max_retries
+        self.backoff          = backoff
+        self.sleep            = sleep
+        self.in_flight        = SingleFlight()
+        self.buckets          = {}
+        for family, limit in rate_limits.items():
+            self.buckets[family] = TokenBucket(limit['rate'], limit['burst'])
+
+    def __retry_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after != None:
+            retry_after = retry_after.strip()
+            if retry_after.isdigit():
+                return float(retry_after)
+            # The other form Retry-After comes in is an HTTP date.
+            retry_at = email.utils.parsedate_tz(retry_after)
+            if retry_at != None:
+                return max(0.0, email.utils.mktime_tz(retry_at) - time.time())
+        return self.backoff * (2 ** attempt)
+
+    def request(self, family, method, url, **kwargs):
+        bucket = self.buckets.get(family)
+        attempt = 0
+        while True:
+            if bucket != None:
+                bucket.acquire()
+            response = self.requests_session.request(method, url, **kwargs)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            delay = self.__retry_delay(response, attempt)
+            if bucket != None:
+                bucket.drain(delay)
+            self.sleep(delay)
+            attempt += 1
+
+    def get(self, family, url, **kwargs):
+        return self.request(family, 'GET', url, **kwargs)
+
+    def post(self, family, url, **kwargs):
+        return self.request(family, 'POST', url, **kwargs)
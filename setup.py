@@ -37,6 +37,10 @@ setup(
                  'desperado'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        # Vectorised fee calculations for whole inventories, see market.calculate_fees_array.
+        'numpy': ['numpy'],
+    },
     license="BSD",
     zip_safe=False,
     keywords='desperado',
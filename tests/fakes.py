@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+fakes
+----------------------------------
+
+Stand-ins for Steam, requests and the clock shared by the tests.
+"""
+
+import json
+
+from desperado import market
+from desperado import transport
+
+
+PROFILE_ID = '76561198000000000'
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse(object):
+    """ A requests.Response carrying json_dict, which can also be streamed in small chunks. """
+    def __init__(self, json_dict = None, status_code = 200, headers = None):
+        self.json_dict   = json_dict
+        self.status_code = status_code
+        self.headers     = headers or {}
+        self.closed      = False
+
+    def json(self):
+        return self.json_dict
+
+    def iter_content(self, chunk_size = 1):
+        # Small chunks, so points and keys get split across them.
+        body = json.dumps(self.json_dict).encode('utf-8')
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    def close(self):
+        self.closed = True
+
+
+def description(class_id, name, tradable = 1, tags = None):
+    """ An rgDescriptions entry of a CS:GO item. """
+    return { 'appid'            : '730',
+             'classid'          : str(class_id),
+             'instanceid'       : '0',
+             'market_name'      : name,
+             'market_hash_name' : name,
+             'tradable'         : tradable,
+             'tags'             : tags or [] }
+
+def asset(asset_id, class_id):
+    """ An rgInventory entry. """
+    return { 'id' : str(asset_id), 'classid' : str(class_id), 'instanceid' : '0', 'amount' : '1', 'pos' : 1 }
+
+
+class FakeInventoryRequestsSession(object):
+    """ Serves pages of (asset_id, class_id, name) tuples, ten assets to a page.
+        Items whose class is in untradable are described as being on a trade hold. """
+    def __init__(self, pages):
+        self.pages      = pages
+        self.requests   = []
+        self.untradable = set()
+
+    def request(self, method, url, params = None, **kwargs):
+        self.requests.append((url, params))
+        page_index = params['start'] // 10
+        page = self.pages[page_index]
+        more = page_index + 1 < len(self.pages)
+        return FakeResponse({
+            'success'        : True,
+            'rgInventory'    : dict((str(asset_id), asset(asset_id, class_id)) for asset_id, class_id, name in page) or [],
+            'rgDescriptions' : dict((str(class_id) + '_0', description(class_id, name, 0 if class_id in self.untradable else 1))
+                                    for asset_id, class_id, name in page) or [],
+            'more'           : more,
+            'more_start'     : (page_index + 1) * 10 if more else False })
+
+
+class FakeSession(object):
+    """ Stands in for a logged in auth.Session that sends its requests to requests_session.
+        Endpoints aren't rate limited unless rate_limits says otherwise. """
+    def __init__(self, requests_session, rate_limits = None):
+        self.requests_session = requests_session
+        self.transport        = transport.Transport(requests_session, rate_limits = rate_limits or {})
+        self.price_data_cache = market.PriceDataCache()
+        self.validations      = 0
+
+    def profile_id(self):
+        return PROFILE_ID
+
+    def ensure_valid(self):
+        self.validations += 1
+        return self
+
+def inventory_session(pages):
+    """ A FakeSession whose inventory is served by a FakeInventoryRequestsSession. """
+    return FakeSession(FakeInventoryRequestsSession(pages))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_auth
+----------------------------------
+
+Tests for `desperado.auth` module.
+"""
+
+import base64
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+from Crypto.Cipher import PKCS1_v1_5
+from Crypto.PublicKey import RSA
+
+from desperado import auth
+from desperado import transport
+from tests.fakes import FakeClock, FakeResponse
+
+
+class FakeRequestsSession(object):
+    def __init__(self):
+        self.cookies   = requests.cookies.RequestsCookieJar()
+        self.logged_in = True
+        self.probes    = 0
+
+    def request(self, method, url, **kwargs):
+        self.probes += 1
+        return FakeResponse({ 'logged_in' : self.logged_in })
+
+
+def make_session(clock):
+    session = auth.Session('user', validation_interval = 60, clock = clock)
+    session.requests_session = FakeRequestsSession()
+    session.transport = transport.Transport(session.requests_session, rate_limits = {})
+    session.requests_session.cookies.set(auth.LOGIN_COOKIE, 'token', domain = 'steamcommunity.com')
+    return session
+
+
+class TestSessionValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.session = make_session(self.clock)
+
+    def test_probe_result_is_reused_for_the_interval(self):
+        self.assertTrue(self.session.is_valid())
+        self.assertTrue(self.session.is_valid())
+        self.assertEqual(self.session.requests_session.probes, 1)
+        self.clock.now += 60
+        self.session.requests_session.logged_in = False
+        self.assertFalse(self.session.is_valid())
+        self.assertEqual(self.session.requests_session.probes, 2)
+
+    def test_expired_cookie_fails_without_probing(self):
+        self.session.requests_session.cookies.set(auth.LOGIN_COOKIE, 'token', domain = 'steamcommunity.com',
+                                                  expires = int(self.clock.now) - 1)
+        self.assertFalse(self.session.is_valid())
+        self.assertEqual(self.session.requests_session.probes, 0)
+
+    def test_ensure_valid_logs_back_in(self):
+        self.session.requests_session.logged_in = False
+        with self.assertRaises(auth.SessionExpired):
+            self.session.ensure_valid()
+
+        relogins = []
+        def relogin(session):
+            relogins.append(session)
+            session.requests_session.cookies.set(auth.LOGIN_COOKIE, 'new', domain = 'steamcommunity.com')
+            session.requests_session.logged_in = True
+        self.session.set_relogin(relogin)
+        self.assertIs(self.session.ensure_valid(), self.session)
+        self.assertEqual(relogins, [self.session])
+        self.session.ensure_valid()
+        self.assertEqual(len(relogins), 1)
+
+
+class FakeLoginRequestsSession(object):
+    """ Plays Steam's login endpoints: asks for a SteamGuard code once, then logs in if the
+        password decrypts correctly. """
+    def __init__(self, password):
+        self.cookies   = requests.cookies.RequestsCookieJar()
+        self.key       = RSA.generate(1024)
+        self.password  = password
+        self.logged_in = False
+        self.logins    = []
+
+    def request(self, method, url, data = None, **kwargs):
+        if url == auth.LOGIN_API['get_rsa_key']['url']:
+            return FakeResponse({ 'success'       : True,
+                                  'publickey_mod' : '%x' % self.key.n,
+                                  'publickey_exp' : '%x' % self.key.e,
+                                  'timestamp'     : '12345' })
+        if url == auth.LOGIN_API['do_login']['url']:
+            self.logins.append(data)
+            password = PKCS1_v1_5.new(self.key).decrypt(base64.b64decode(data['password']), None)
+            if password != self.password.encode('utf-8'):
+                return FakeResponse({ 'success' : False, 'captcha_needed' : False, 'emailauth_needed' : False })
+            if data['emailauth'] != 'CODE1':
+                return FakeResponse({ 'success' : False, 'captcha_needed' : False, 'emailauth_needed' : True })
+            self.logged_in = True
+            self.cookies.set(auth.LOGIN_COOKIE, 'fresh', domain = 'steamcommunity.com')
+            return FakeResponse({ 'success' : True, 'login_complete' : True })
+        return FakeResponse({ 'logged_in' : self.logged_in })
+
+
+class TestRelogin(unittest.TestCase):
+
+    def test_ensure_valid_runs_the_login_sequence(self):
+        session = auth.Session('user', clock = FakeClock())
+        session.requests_session = FakeLoginRequestsSession(u'hunter2€')
+        session.transport = transport.Transport(session.requests_session, rate_limits = {})
+        session.requests_session.cookies.set(auth.LOGIN_COOKIE, 'stale', domain = 'steamcommunity.com')
+
+        authenticate = getattr(auth, '__authenticate')
+        session.set_relogin(lambda session: authenticate(session, u'hunter2€', lambda: 'CODE1', None, 5))
+        self.assertIs(session.ensure_valid(), session)
+        self.assertEqual([data['emailauth'] for data in session.requests_session.logins], ['', 'CODE1'])
+        self.assertEqual(session.requests_session.cookies[auth.LOGIN_COOKIE], 'fresh')
+        self.assertTrue(session.is_valid(force = True))
+
+    def test_wrong_password_is_reported(self):
+        session = auth.Session('user')
+        session.requests_session = FakeLoginRequestsSession('right')
+        session.transport = transport.Transport(session.requests_session, rate_limits = {})
+        with self.assertRaises(auth.InvalidLoginState):
+            getattr(auth, '__authenticate')(session, 'wrong', lambda: 'CODE1', None, 5)
+
+
+class TestSessionPersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = auth.Session('user')
+        self.session.requests_session.cookies.set(auth.LOGIN_COOKIE, 'token', domain = 'steamcommunity.com',
+                                                  secure = True, expires = 4102444800, rest = { 'HttpOnly' : None })
+        self.session.requests_session.cookies.set('sessionid', 'abc', domain = 'steamcommunity.com')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        path = auth.save_session(self.session, self.directory)
+        self.assertEqual(os.listdir(self.directory), ['user.session.json'])
+        loaded = auth.load_session('user', self.directory)
+        self.assertEqual(loaded.username, 'user')
+        cookies = dict((cookie.name, cookie) for cookie in loaded.requests_session.cookies)
+        self.assertEqual(cookies[auth.LOGIN_COOKIE].value, 'token')
+        self.assertTrue(cookies[auth.LOGIN_COOKIE].secure)
+        self.assertTrue(cookies[auth.LOGIN_COOKIE].has_nonstandard_attr('HttpOnly'))
+        self.assertEqual(cookies['sessionid'].value, 'abc')
+        self.assertEqual(auth.Session.from_json(dict(self.session.to_json(), profile_id = '7656')).profile_id(), '7656')
+        with open(path) as infile:
+            self.assertEqual(json.load(infile)['expires_at'], 4102444800)
+
+    def test_rejects_other_versions_and_expired_logins(self):
+        self.assertIsNone(auth.load_session('user', self.directory))
+        path = auth.save_session(self.session, self.directory)
+        with open(path) as infile:
+            state = json.load(infile)
+        state['version'] += 1
+        with open(path, 'w') as outfile:
+            json.dump(state, outfile)
+        self.assertIsNone(auth.load_session('user', self.directory))
+
+        state['version'] -= 1
+        state['expires_at'] = 1
+        with open(path, 'w') as outfile:
+            json.dump(state, outfile)
+        self.assertIsNone(auth.load_session('user', self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
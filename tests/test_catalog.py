@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_catalog
+----------------------------------
+
+Tests for `desperado.catalog` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desperado import catalog
+from desperado import inventory
+from tests.fakes import description, inventory_session
+
+
+class TestDescriptionCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'catalog.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_descriptions_are_shared_between_accounts(self):
+        descriptions = catalog.DescriptionCatalog()
+        first  = inventory.retrieve_profile_inventory(inventory_session([[(1, 100, 'Case')]]), 730, catalog = descriptions)
+        second = inventory.retrieve_profile_inventory(inventory_session([[(7, 100, 'Case'), (8, 200, 'Key')]]), 730,
+                                                      catalog = descriptions)
+        self.assertIs(first.items[0].description, second.items_by_id()[7].description)
+        self.assertEqual(len(descriptions), 2)
+
+    def test_persists_across_runs(self):
+        tags = [{ 'category' : 'Type', 'name' : 'Container' }]
+        descriptions = catalog.DescriptionCatalog(self.path)
+        descriptions.resolve(730, 100, 0, description(100, u'StatTrak™ Case', tags = tags))
+        descriptions.flush()
+
+        reopened = catalog.DescriptionCatalog(self.path)
+        known = reopened.get(730, 100, 0)
+        self.assertEqual(known.market_hash_name, u'StatTrak™ Case')
+        self.assertEqual(known.tags, { 'Type' : 'Container' })
+        self.assertTrue(known.tradable)
+        self.assertIsNone(reopened.get(730, 200, 0))
+
+    def test_tradable_mismatch_is_not_shared(self):
+        descriptions = catalog.DescriptionCatalog()
+        tradable = descriptions.resolve(730, 100, 0, description(100, 'Case'))
+        on_hold  = descriptions.resolve(730, 100, 0, description(100, 'Case', tradable = 0))
+        self.assertIsNot(tradable, on_hold)
+        self.assertFalse(on_hold.tradable)
+        self.assertIs(descriptions.get(730, 100, 0), tradable)
+
+    def test_trade_held_first_copy_does_not_decide_for_later_ones(self):
+        descriptions = catalog.DescriptionCatalog(self.path)
+        on_hold = descriptions.resolve(730, 100, 0, description(100, 'Case', tradable = 0))
+        first   = descriptions.resolve(730, 100, 0, description(100, 'Case'))
+        second  = descriptions.resolve(730, 100, 0, description(100, 'Case'))
+        self.assertFalse(on_hold.tradable)
+        self.assertIs(first, second)
+        self.assertTrue(first.tradable)
+        descriptions.flush()
+        self.assertTrue(catalog.DescriptionCatalog(self.path).get(730, 100, 0).tradable)
+
+    def test_renamed_items_replace_the_catalog_entry(self):
+        snapshot_path = os.path.join(self.directory, 'csgo.snapshot')
+        session = inventory_session([[(1, 100, 'Case')]])
+        inventory.sync_profile_inventory(session, 730, snapshot_path, catalog = catalog.DescriptionCatalog(self.path))
+
+        session.requests_session.pages = [[(1, 100, 'Case Renamed')]]
+        sync = inventory.sync_profile_inventory(session, 730, snapshot_path, catalog = catalog.DescriptionCatalog(self.path))
+        self.assertEqual([item.market_hash_name() for item in sync.inventory.items], ['Case Renamed'])
+        self.assertEqual(sync.changed, [1])
+        self.assertEqual(catalog.DescriptionCatalog(self.path).get(730, 100, 0).market_name, 'Case Renamed')
+
+    def test_changed_tags_replace_the_catalog_entry(self):
+        descriptions = catalog.DescriptionCatalog()
+        old = descriptions.resolve(730, 100, 0, description(100, 'Case', tags = [{ 'category' : 'Type', 'name' : 'Case' }]))
+        new = descriptions.resolve(730, 100, 0, description(100, 'Case', tags = [{ 'category' : 'Type', 'name' : 'Container' }]))
+        self.assertIsNot(old, new)
+        self.assertEqual(descriptions.get(730, 100, 0).tags, { 'Type' : 'Container' })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_currency
+----------------------------------
+
+Tests for `desperado.currency` module.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from desperado import currency
+from desperado.currency import Money
+from tests.fakes import FakeClock
+
+
+class TestParseMoney(unittest.TestCase):
+
+    def test_steam_formats(self):
+        cases = [("$1.5",          Money(150,    'USD')),
+                 ("$1,234.56",     Money(123456, 'USD')),
+                 ("$0.03 USD",     Money(3,      'USD')),
+                 ("1.234,56€",     Money(123456, 'EUR')),
+                 ("0,--€",         Money(0,      'EUR')),
+                 (u"1 234,56 pуб.", Money(123456, 'RUB')),
+                 ("R$ 12,30",      Money(1230,   'BRL')),
+                 ("CDN$ 0.99",     Money(99,     'CAD')),
+                 (u"¥ 1,234",      Money(123400, 'JPY'))]
+        for text, expected in cases:
+            self.assertEqual(currency.parse_money(text), expected, text)
+
+    def test_str_round_trips(self):
+        for amount in [Money(123456, 'USD'), Money(5, 'EUR'), Money(-1999, 'GBP'), Money(100000, 'RUB')]:
+            self.assertEqual(Money.from_string(str(amount)), amount)
+
+    def test_rejects_garbage(self):
+        for text in ["", "$", "abc", "1.2.3x", u"€1 $"]:
+            with self.assertRaises(currency.InvalidCurrencyFormat):
+                currency.parse_money(text)
+        with self.assertRaises(currency.InvalidCurrencyFormat):
+            currency.parse_money("1,00€", 'USD')
+
+
+class TestMoney(unittest.TestCase):
+
+    def test_arithmetic_and_ordering(self):
+        amounts = [Money(150), Money(25), Money(5)]
+        self.assertEqual(sum(amounts), Money(180))
+        self.assertEqual(Money.total(amounts), Money(180))
+        self.assertEqual(sorted(amounts)[0], Money(5))
+        self.assertEqual(len(set([Money(5), Money(5), Money(5, 'EUR')])), 2)
+        with self.assertRaises(currency.CurrencyMismatch):
+            Money(5) + Money(5, 'EUR')
+        with self.assertRaises(currency.CurrencyMismatch):
+            Money(5) < Money(5, 'EUR')
+
+    def test_dollars_compatibility(self):
+        dollars = currency.Dollars.from_string("$1.5")
+        self.assertEqual((dollars.dollars, dollars.to_cents(), str(dollars)), (1, 150, "$1.50"))
+        self.assertEqual(pickle.loads(pickle.dumps(dollars)), dollars)
+        self.assertEqual(dollars + currency.Dollars.from_cents(50), Money(200))
+
+    def test_dollars_keep_their_old_fields(self):
+        dollars = currency.Dollars(1, 50)
+        self.assertEqual((dollars.dollars, dollars.cents, dollars.only_cents), (1, 50, 150))
+        total = dollars + currency.Dollars.from_cents(275)
+        self.assertIsInstance(total, currency.Dollars)
+        self.assertEqual((total.dollars, total.cents), (4, 25))
+        self.assertEqual(type(dollars + Money(5)), Money)
+
+
+class TestConversionTable(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'rates.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rate_is_median_of_samples(self):
+        table = currency.ConversionTable(clock = self.clock)
+        samples = [(Money(100), Money(90, 'EUR')), (Money(200), Money(184, 'EUR')),
+                   (Money(300), Money(600, 'EUR')), (Money(0), Money(5, 'EUR'))]
+        self.assertAlmostEqual(table.add_samples('EUR', samples), 0.92)
+        self.assertEqual(table.convert(Money(1000), 'EUR'), Money(920, 'EUR'))
+        self.assertEqual(table.convert(Money(920, 'EUR'), 'USD'), Money(1000))
+        with self.assertRaises(currency.MissingConversionRate):
+            table.convert(Money(1000), 'RUB')
+
+    def test_rates_are_saved_and_go_stale(self):
+        table = currency.ConversionTable(self.path, refresh_interval = 60, clock = self.clock)
+        self.assertTrue(table.is_stale('EUR'))
+        table.set_rate('EUR', 0.9)
+        table.save()
+        self.clock.now += 30
+        reopened = currency.ConversionTable(self.path, refresh_interval = 60, clock = self.clock)
+        self.assertEqual(reopened.rate('EUR'), 0.9)
+        self.assertFalse(reopened.is_stale('EUR'))
+        self.assertFalse(reopened.is_stale('USD'))
+        self.clock.now += 30
+        self.assertTrue(reopened.is_stale('EUR'))
+
+
+if __name__ == '__main__':
+    unittest.main()
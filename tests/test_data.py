@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_data
+----------------------------------
+
+Tests for `desperado.data` module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from desperado import data
+
+
+class TestApplicationRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'apps.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_builtin_applications(self):
+        registry = data.ApplicationRegistry()
+        self.assertEqual(registry.name(730), 'Counter-Strike: Global Offensive')
+        self.assertEqual(registry.name('570'), 'Dota 2')
+        self.assertEqual(registry.short_name(1), data.UNKNOWN_SHORT_APP_NAME)
+        self.assertEqual(registry.app_id('tf2'), 440)
+        self.assertEqual(data.application_name('abc'), data.INVALID_APP_ID)
+        self.assertIn(620, data.APP_IDS)
+        self.assertEqual(data.APP_SHORT_NAME_TO_ID['csgo'], 730)
+
+    def test_loads_steam_app_list_lazily(self):
+        with open(self.path, 'w') as outfile:
+            json.dump({ 'applist' : { 'apps' : [{ 'appid' : 252490, 'name' : 'Rust' },
+                                                { 'appid' : 1, 'name' : '' }] } }, outfile)
+        registry = data.ApplicationRegistry(self.path)
+        os.remove(self.path)
+        # Nothing was read yet, so the catalog is gone by the time we look.
+        self.assertNotIn(252490, registry)
+
+        with open(self.path, 'w') as outfile:
+            json.dump({ 'applist' : { 'apps' : [{ 'appid' : 252490, 'name' : 'Rust' }] } }, outfile)
+        registry = data.ApplicationRegistry(self.path)
+        self.assertEqual(registry.short_name(252490), 'rust')
+        self.assertEqual(registry.app_id('rust'), 252490)
+
+    def test_register_and_save(self):
+        registry = data.ApplicationRegistry(self.path)
+        registry.register(753, 'Steam', 'steamcommunity', context_id = 6)
+        registry.save()
+        reopened = data.ApplicationRegistry(self.path)
+        self.assertEqual(reopened.context_id(753), 6)
+        self.assertEqual(reopened.app_id('steamcommunity'), 753)
+        self.assertEqual(len(reopened), len(data.APPLICATION_DATA) + 1)
+
+    def test_app_list_entries_are_not_trading_applications(self):
+        with open(self.path, 'w') as outfile:
+            json.dump({ 'applist' : { 'apps' : [{ 'appid' : 252490, 'name' : 'Rust' },
+                                                { 'appid' : 730, 'name' : 'Counter-Strike: Global Offensive' }] } }, outfile)
+        registry = data.ApplicationRegistry(self.path)
+        registry.register(753, 'Steam', 'steamcommunity', context_id = 6)
+        self.assertIn(252490, registry.app_ids())
+        self.assertEqual(sorted(registry.trading_app_ids()), [440, 570, 620, 723, 730, 753])
+
+        registry.save()
+        self.assertNotIn(252490, data.ApplicationRegistry(self.path).trading_app_ids())
+
+    def test_tables_are_updated_in_place(self):
+        registry = data.ApplicationRegistry()
+        names = registry.names_by_id
+        registry.register(252490, 'Rust')
+        self.assertEqual(names[252490], 'Rust')
+        self.assertEqual(registry.ids_by_short_name['rust'], 252490)
+        self.assertIn(252490, registry.ids)
+        self.assertIs(data.APP_NAMES, data.REGISTRY.names_by_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,7 +10,7 @@ Tests for `desperado` module.
 
 import unittest
 
-from desperado import desperado
+import desperado
 
 
 class TestDesperado(unittest.TestCase):
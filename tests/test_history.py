@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_history
+----------------------------------
+
+Tests for `desperado.history` module and the price history parsing in `desperado.market`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desperado import history
+from desperado import market
+from tests.fakes import FakeResponse, FakeSession
+
+
+class FakeRequestsSession(object):
+    def __init__(self, prices):
+        self.prices   = prices
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        self.kwargs    = kwargs
+        return FakeResponse({'success' : True, 'prices' : self.prices})
+
+
+class TestItemPriceHistory(unittest.TestCase):
+
+    def test_parse_date(self):
+        self.assertEqual(market.parse_price_history_date('Dec 06 2013 01: +0'), 1386291600)
+
+    def test_from_json_dict(self):
+        parsed = market.ItemPriceHistory.from_json_dict({'prices' : [
+            ['Dec 06 2013 01: +0', 5.437, '1'],
+            ['Dec 07 2013 01: +0', 4.5, '1,024']]})
+        self.assertEqual(list(parsed.timestamps), [1386291600, 1386378000])
+        self.assertEqual(list(parsed.prices), [5.437, 4.5])
+        self.assertEqual(list(parsed.volumes), [1, 1024])
+
+    def test_streaming_parser(self):
+        body = (u'{"success":true,"price_prefix":"€","prices":[["Dec 06 2013 01: +0",5.437,"1"],'
+                u'\n ["Dec 07 2013 23: +0", 1e-2, "1,024"]],"price_suffix":""}').encode('utf-8')
+        for chunk_size in [1, 3, 4096]:
+            parser = market.PriceHistoryParser()
+            for start in range(0, len(body), chunk_size):
+                parser.feed(body[start:start + chunk_size])
+            self.assertTrue(parser.success())
+            parsed = parser.close()
+            self.assertEqual(list(parsed.timestamps), [1386291600, 1386457200])
+            self.assertEqual(list(parsed.prices), [5.437, 0.01])
+            self.assertEqual(list(parsed.volumes), [1, 1024])
+
+    def test_streaming_parser_failures(self):
+        parser = market.PriceHistoryParser()
+        parser.feed(b'{"success":false,"prices":false}')
+        self.assertFalse(parser.success())
+        parser = market.PriceHistoryParser()
+        parser.feed(b'{"success":true,"prices":[["Dec 06 2013 01: +0",5.0,"1"]')
+        with self.assertRaises(ValueError):
+            parser.close()
+        with self.assertRaises(ValueError):
+            market.PriceHistoryParser().feed(b'{"prices":[["Dec 06 2013 01: +0",{}]]}')
+
+    def test_get_item_price_history_streams(self):
+        session = FakeSession(FakeRequestsSession([['Dec 06 2013 01: +0', 5.0, '1'], ['Dec 06 2013 02: +0', 6.0, '2']]))
+        fetched = market.get_item_price_history(session, 730, 'Item')
+        self.assertEqual(list(fetched.timestamps), [1386291600, 1386295200])
+        self.assertTrue(session.requests_session.kwargs['stream'])
+
+    def test_extend_only_appends_newer_points(self):
+        old = market.ItemPriceHistory()
+        old.append(10, 1.0, 1)
+        old.append(20, 2.0, 2)
+        new = market.ItemPriceHistory()
+        for timestamp in [10, 20, 30, 40]:
+            new.append(timestamp, 9.0, 9)
+        self.assertEqual(old.extend(new), 2)
+        self.assertEqual(list(old.timestamps), [10, 20, 30, 40])
+        self.assertEqual(list(old.since(25).timestamps), [30, 40])
+
+
+class TestPriceHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = history.PriceHistoryStore(os.path.join(self.directory, 'history.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_refresh_appends_incrementally(self):
+        session = FakeSession(FakeRequestsSession([['Dec 06 2013 01: +0', 5.0, '1']]))
+        self.store.refresh(session, 730, 'Item')
+        session.requests_session.prices = [['Dec 06 2013 01: +0', 7.0, '3'],
+                                           ['Dec 07 2013 01: +0', 6.0, '2']]
+        refreshed = self.store.refresh(session, 730, 'Item')
+        self.assertEqual(list(refreshed.prices), [5.0, 6.0])
+        stored = self.store.load(730, 'Item')
+        self.assertEqual(list(stored.timestamps), [1386291600, 1386378000])
+        self.assertEqual(list(stored.volumes), [1, 2])
+
+    def test_recent_refresh_skips_request(self):
+        session = FakeSession(FakeRequestsSession([['Dec 06 2013 01: +0', 5.0, '1']]))
+        self.store.refresh(session, 730, 'Item', max_age = 3600)
+        self.store.refresh(session, 730, 'Item', max_age = 3600)
+        self.assertEqual(session.requests_session.requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_inventory
+----------------------------------
+
+Tests for `desperado.inventory` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desperado import inventory
+from desperado import market
+from tests.fakes import FakeResponse, FakeSession, asset, description, inventory_session
+
+
+class TestIterProfileInventory(unittest.TestCase):
+
+    def test_follows_more_start(self):
+        session = inventory_session([[(1, 100, 'Case'), (2, 100, 'Case')],
+                               [(3, 200, 'Key')]])
+        items = list(inventory.iter_profile_inventory(session, 730, page_size = 10))
+        self.assertEqual(sorted(item.id() for item in items), [1, 2, 3])
+        self.assertEqual([params['start'] for url, params in session.requests_session.requests], [0, 10])
+        self.assertEqual(session.requests_session.requests[0][0],
+                         'https://steamcommunity.com/profiles/76561198000000000/inventory/json/730/2/')
+
+    def test_empty_inventory(self):
+        session = inventory_session([[]])
+        self.assertEqual(inventory.retrieve_profile_inventory(session, 730).items, [])
+
+
+class TestInventoryItem(unittest.TestCase):
+
+    def test_items_share_descriptions(self):
+        session = inventory_session([[(1, 100, 'Case'), (2, 100, 'Case')],
+                               [(3, 100, 'Case'), (4, 200, 'Key')]])
+        items = sorted(inventory.iter_profile_inventory(session, 730, page_size = 10), key = lambda item: item.id())
+        self.assertIs(items[0].description, items[2].description)
+        self.assertIsNot(items[0].description, items[3].description)
+
+    def test_typed_fields_and_lazy_tags(self):
+        shared = inventory.ItemDescription(description(100, 'Chroma Case', tradable = '0', tags = [
+            {'category' : 'Type', 'name' : 'Container', 'category_name' : 'Type'}]))
+        item = inventory.InventoryItem.from_json(asset(5, 100), shared)
+        self.assertEqual((item.id(), item.class_id(), item.instance_id(), item.amount()), (5, 100, 0, 1))
+        self.assertEqual(item.app_id(), 730)
+        self.assertFalse(item.can_trade())
+        self.assertIsNone(shared._tags)
+        self.assertTrue(item.tag_contains('Type', 'container'))
+        self.assertEqual(item.tags, {'Type' : 'Container'})
+        self.assertFalse(hasattr(item, '__dict__'))
+
+
+class TestInventoryWhere(unittest.TestCase):
+
+    def setUp(self):
+        def item(asset_id, name, tradable, tags):
+            shared = inventory.ItemDescription(description(asset_id, name, tradable, 
+                    [{'category' : category, 'name' : value} for category, value in tags.items()]))
+            return inventory.InventoryItem.from_json(asset(asset_id, asset_id), shared)
+
+        self.items = [
+            item(1, 'Chroma Case',          1, {'Type' : 'Container', 'Quality' : 'Normal'}),
+            item(2, 'StatTrak AK-47',       1, {'Type' : 'Rifle',     'Quality' : 'StatTrak\u2122'}),
+            item(3, 'Sticker Capsule',      0, {'Type' : 'Container', 'Quality' : 'Normal'}),
+            item(4, 'Chroma Case',          1, {'Type' : 'Container', 'Quality' : 'Normal'}),
+            item(5, 'AK-47',                1, {'Type' : 'Rifle'})]
+        self.inventory = inventory.Inventory('76561198000000000', self.items)
+
+    def ids(self, items):
+        return [item.id() for item in items]
+
+    def test_tag_queries(self):
+        self.assertEqual(self.ids(self.inventory.where(Type = 'Container')), [1, 3, 4])
+        self.assertEqual(self.ids(self.inventory.where(Type__contains = 'contain', tradable = True)), [1, 4])
+        self.assertEqual(self.ids(self.inventory.where(Quality__contains = 'stattrak')), [2])
+        self.assertEqual(self.ids(self.inventory.where(tradable = False)), [3])
+        self.assertEqual(self.ids(self.inventory.where(Missing = 'Anything')), [])
+
+    def test_name_queries(self):
+        self.assertEqual(self.ids(self.inventory.where(market_hash_name = 'Chroma Case')), [1, 4])
+        self.assertEqual(self.ids(self.inventory.where(market_hash_name = 'AK-47', Type = 'Rifle')), [5])
+
+    def test_indexes_follow_added_items(self):
+        self.inventory.where(Type = 'Rifle')
+        self.items.append(self.items[0])
+        self.assertEqual(self.inventory.indexes().size, 6)
+
+    def test_indexes_follow_mutation(self):
+        rifle = self.items[1]
+        self.assertEqual(self.ids(self.inventory.where(Type = 'Rifle', tradable = True)), [2, 5])
+        self.inventory.remove(rifle)
+        self.assertEqual(self.ids(self.inventory.where(Type = 'Rifle', tradable = True)), [5])
+        self.inventory.add(rifle)
+        self.assertEqual(self.ids(self.inventory.where(Type = 'Rifle', tradable = True)), [5, 2])
+        # Same number of items, but a different one.
+        self.inventory.items = [self.items[0], self.items[1], self.items[2], self.items[0], self.items[1]]
+        self.assertEqual(self.ids(self.inventory.where(Type = 'Rifle')), [])
+
+    def test_unsupported_lookup(self):
+        with self.assertRaises(ValueError):
+            self.inventory.where(Type__startswith = 'Con')
+
+
+class FakeMultiAppRequestsSession(object):
+    def request(self, method, url, params = None, **kwargs):
+        app_id = int(url.rstrip('/').split('/')[-2])
+        if app_id == 440:
+            return FakeResponse({'success' : False})
+        return FakeResponse({
+            'success'        : True,
+            'rgInventory'    : {str(app_id) : asset(app_id, 1)},
+            'rgDescriptions' : {'1_0' : dict(description(1, 'Item ' + str(app_id)), appid = str(app_id))},
+            'more'           : False })
+
+
+class TestRetrieveAllInventories(unittest.TestCase):
+
+    def test_failures_are_reported_per_app(self):
+        session = FakeSession(FakeMultiAppRequestsSession())
+        account = inventory.retrieve_all_inventories(session, [730, 440, 570], workers = 3)
+        self.assertEqual(list(account.inventories), [730, 570])
+        self.assertEqual(list(account.errors), [440])
+        self.assertIsInstance(account.errors[440], inventory.InventoryRetrievalError)
+        self.assertEqual(account[570].items[0].market_hash_name(), 'Item 570')
+        self.assertIs(account['dota2'], account[570])
+        self.assertNotIn('tf2', account)
+        self.assertEqual(sorted(item.app_id() for item in account.items()), [570, 730])
+        self.assertEqual(len(account.where(tradable = True)), 2)
+
+
+class FakePriceRequestsSession(object):
+    PRICES = { 'Chroma Case' : ('$0.50', '$0.60'), 'AK-47' : ('$10.00', '$11.50'), 'Junk' : ('$0.02', '$0.02'),
+               'Unlisted'    : (None, '$0.30') }
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, params = None, **kwargs):
+        self.requests.append(params['market_hash_name'])
+        if params['market_hash_name'] not in self.PRICES:
+            return FakeResponse({'success' : False})
+        low, median = self.PRICES[params['market_hash_name']]
+        response = {'success' : True, 'volume' : '5', 'median_price' : median}
+        if low != None:
+            response['lowest_price'] = low
+        return FakeResponse(response)
+
+
+class TestValue(unittest.TestCase):
+
+    def setUp(self):
+        def item(asset_id, name, tradable, tags):
+            shared = inventory.ItemDescription(description(asset_id, name, tradable, 
+                    [{'category' : category, 'name' : value} for category, value in tags.items()]))
+            return inventory.InventoryItem.from_json(asset(asset_id, asset_id), shared)
+
+        self.inventory = inventory.Inventory('76561198000000000', [
+            item(1, 'Chroma Case', 1, {'Type' : 'Container'}),
+            item(2, 'Chroma Case', 1, {'Type' : 'Container'}),
+            item(3, 'AK-47',       1, {'Type' : 'Rifle'}),
+            item(4, 'AK-47',       0, {'Type' : 'Rifle'}),
+            item(5, 'Junk',        1, {'Type' : 'Container'})], 730)
+        self.session = FakeSession(FakePriceRequestsSession())
+
+    def test_each_name_is_priced_once(self):
+        valuation = inventory.value(self.session, self.inventory)
+        self.assertEqual(sorted(self.session.requests_session.requests), ['AK-47', 'Chroma Case', 'Junk'])
+        self.assertEqual(valuation.total, 50 + 50 + 1000 + 2)
+        self.assertEqual(valuation.counts[(730, 'Chroma Case')], 2)
+        self.assertEqual(valuation.tag_totals, {'Type' : {'Container' : 102, 'Rifle' : 1000}})
+        self.assertEqual(valuation.list_price_of(self.inventory.items[0]), market.get_desired_price(50))
+        self.assertEqual(valuation.net_total, 2 * market.get_desired_price(50) + market.get_desired_price(1000))
+
+    def test_median_strategy_and_sales(self):
+        valuation = inventory.value(self.session, self.inventory, strategy = 'median')
+        self.assertEqual(valuation.price_of(self.inventory.items[2]), 1150)
+        self.assertEqual(valuation.price_of(self.inventory.items[3]), 0)
+        sales = valuation.sales(self.inventory.items)
+        self.assertEqual([item.id() for item, price in sales], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            inventory.value(self.session, self.inventory, strategy = 'mean')
+
+    def test_unpriced_items_do_not_fail_the_valuation(self):
+        self.inventory.add(inventory.InventoryItem.from_json(asset(6, 6), inventory.ItemDescription(description(6, 'Unlisted'))))
+        self.inventory.add(inventory.InventoryItem.from_json(asset(7, 7), inventory.ItemDescription(description(7, 'Delisted'))))
+        valuation = inventory.value(self.session, self.inventory)
+        self.assertEqual(valuation.price_of(self.inventory.items[5]), 30)
+        self.assertEqual(valuation.price_of(self.inventory.items[6]), 0)
+        self.assertEqual(list(valuation.errors), [(730, 'Delisted')])
+        self.assertEqual(valuation.total, 50 + 50 + 1000 + 2 + 30)
+
+
+class TestSyncProfileInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'csgo.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_round_trip(self):
+        session = inventory_session([[(1, 100, 'Case'), (2, 200, 'Key')]])
+        inv = inventory.retrieve_profile_inventory(session, 730)
+        inv.items[0].tags
+        inventory.save_inventory_snapshot(inv, self.path)
+        loaded = inventory.load_inventory_snapshot(self.path)
+        self.assertEqual((loaded.profile_id, loaded.app_id, loaded.context_id), ('76561198000000000', 730, 2))
+        self.assertEqual([(item.id(), item.market_hash_name(), item.can_trade()) for item in loaded.items],
+                         [(item.id(), item.market_hash_name(), item.can_trade()) for item in inv.items])
+
+    def test_sync_reports_diff_and_reuses_items(self):
+        session = inventory_session([[(1, 100, 'Case'), (2, 100, 'Case'), (3, 200, 'Key')]])
+        first = inventory.sync_profile_inventory(session, 730, self.path)
+        self.assertEqual(sorted(first.added), [1, 2, 3])
+        self.assertEqual(first.removed, [])
+
+        session.requests_session.pages = [[(1, 100, 'Case'), (3, 300, 'Pass'), (4, 200, 'Key')]]
+        second = inventory.sync_profile_inventory(session, 730, self.path)
+        self.assertEqual(second.added, [4])
+        self.assertEqual(second.removed, [2])
+        self.assertEqual(second.changed, [3])
+        self.assertEqual(sorted(item.id() for item in second.inventory.items), [1, 3, 4])
+
+        third = inventory.sync_profile_inventory(session, 730, self.path)
+        self.assertEqual((third.added, third.removed, third.changed), ([], [], []))
+
+    def test_expired_trade_hold_is_noticed(self):
+        session = inventory_session([[(1, 100, 'Case')]])
+        session.requests_session.untradable.add(100)
+        first = inventory.sync_profile_inventory(session, 730, self.path)
+        self.assertFalse(first.inventory.items[0].can_trade())
+
+        session.requests_session.untradable.clear()
+        session.requests_session.pages = [[(1, 100, 'Case'), (2, 100, 'Case')]]
+        second = inventory.sync_profile_inventory(session, 730, self.path)
+        self.assertEqual(second.added, [2])
+        self.assertEqual(second.changed, [1])
+        self.assertTrue(all(item.can_trade() for item in second.inventory.items))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_market
+----------------------------------
+
+Tests for `desperado.market` module.
+"""
+
+import array
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from desperado import currency
+from desperado import market
+from tests.fakes import FakeClock, FakeResponse, FakeSession
+
+
+class TestPriceDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = market.PriceDataCache(ttl = 60, max_size = 3, clock = self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get_data(730, 'Item'))
+        self.cache.set_data(730, 'Item', 'data')
+        self.assertEqual(self.cache.get_data(730, 'Item'), 'data')
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_entries_expire(self):
+        self.cache.set_data(730, 'Item', 'data')
+        self.clock.now += 60
+        self.assertIsNone(self.cache.get_data(730, 'Item'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        for name in ['A', 'B', 'C']:
+            self.cache.set_data(730, name, name)
+        self.cache.get_data(730, 'A')
+        self.cache.set_data(730, 'D', 'D')
+        self.assertIsNone(self.cache.get_data(730, 'B'))
+        self.assertEqual(self.cache.get_data(730, 'A'), 'A')
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_invalidate(self):
+        self.cache.set_data(730, 'A', 'A')
+        self.cache.set_data(570, 'A', 'A')
+        self.cache.set_data(570, 'B', 'B')
+        self.assertEqual(self.cache.invalidate(app_id = 570), 2)
+        self.assertEqual(self.cache.get_data(730, 'A'), 'A')
+        self.cache.set_data(570, 'A', 'A')
+        self.assertEqual(self.cache.invalidate(market_hash_name = 'A'), 2)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestSQLitePriceDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'prices.sqlite')
+        self.cache = market.SQLitePriceDataCache(self.path, ttl = 60, clock = self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_survive_reopening(self):
+        self.cache.set_data(730, 'Item', market.ItemPriceData('$1.23', '1,024', '$1.50'))
+        reopened = market.SQLitePriceDataCache(self.path, ttl = 60, clock = self.clock)
+        data = reopened.get_data(730, 'Item')
+        self.assertEqual(data.low_price.to_cents(), 123)
+        self.assertEqual(data.median_price.to_cents(), 150)
+        self.assertEqual(data.volume, '1,024')
+
+    def test_stale_entries_are_misses(self):
+        self.cache.set_data(730, 'Item', market.ItemPriceData('$1.23', 0, '$0.00'))
+        self.clock.now += 60
+        self.assertIsNone(self.cache.get_data(730, 'Item'))
+        self.assertEqual(self.cache.purge_expired(), 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        for app_id, name in [(730, 'A'), (570, 'A'), (570, 'B')]:
+            self.cache.set_data(app_id, name, market.ItemPriceData('$0.10', 0, '$0.00'))
+        self.assertEqual(self.cache.invalidate(app_id = 570, market_hash_name = 'A'), 1)
+        self.assertEqual(self.cache.invalidate(market_hash_name = 'A'), 1)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_entries_are_kept_per_currency(self):
+        self.cache.set_data(730, 'Item', market.ItemPriceData('$1.23', 0))
+        self.cache.set_data(730, 'Item', market.ItemPriceData('1,10€', 0), 3)
+        self.assertEqual(self.cache.get_data(730, 'Item').low_price, currency.Money(123, 'USD'))
+        self.assertEqual(self.cache.get_data(730, 'Item', 3).low_price, currency.Money(110, 'EUR'))
+        self.assertIsNone(self.cache.get_data(730, 'Item', 5))
+
+    def test_old_schema_is_replaced(self):
+        path = os.path.join(self.directory, 'old.sqlite')
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE price_data (app_id INTEGER NOT NULL, market_hash_name TEXT NOT NULL, "
+                           "low_price TEXT NOT NULL, volume, median_price TEXT NOT NULL, fetched_at REAL NOT NULL, "
+                           "PRIMARY KEY (app_id, market_hash_name))")
+        connection.commit()
+        connection.close()
+        cache = market.SQLitePriceDataCache(path, clock = self.clock)
+        cache.set_data(730, 'Item', market.ItemPriceData('$1.23', 0), 3)
+        self.assertEqual(len(cache), 1)
+
+
+class FakeRequestsSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, params = None, **kwargs):
+        self.requests.append((url, params))
+        if params['market_hash_name'] == 'Broken':
+            return FakeResponse({'success' : False})
+        if params['market_hash_name'] == 'Unlisted':
+            return FakeResponse({'success' : True, 'volume' : '3', 'median_price' : '$0.40'})
+        if params['market_hash_name'] == 'Unsold':
+            return FakeResponse({'success' : True})
+        if params['currency'] == 3:
+            return FakeResponse({'success'      : True,
+                                 'lowest_price' : '0,22€',
+                                 'volume'       : '10',
+                                 'median_price' : '0,27€'})
+        return FakeResponse({'success'      : True,
+                             'lowest_price' : '$0.25',
+                             'volume'       : '10',
+                             'median_price' : '$0.30'})
+
+
+class TestGetItemPriceOverviews(unittest.TestCase):
+
+    def test_dedupes_and_uses_cache(self):
+        session = FakeSession(FakeRequestsSession())
+        session.price_data_cache.set_data(730, 'Cached', market.ItemPriceData('$9.99', 0, '$0.00'))
+        keys = [(730, 'A'), (730, 'B'), (730, 'A'), (730, 'Cached')]
+        results = market.get_item_price_overviews(session, keys, workers = 4)
+        self.assertEqual(sorted(results), [(730, 'A'), (730, 'B'), (730, 'Cached')])
+        self.assertEqual(len(session.requests_session.requests), 2)
+        self.assertEqual(results[(730, 'A')].low_price.to_cents(), 25)
+        self.assertEqual(results[(730, 'Cached')].low_price.to_cents(), 999)
+        self.assertIsNotNone(session.price_data_cache.get_data(730, 'B'))
+
+    def test_failure_is_raised(self):
+        session = FakeSession(FakeRequestsSession())
+        with self.assertRaises(market.ItemPriceOverviewRetreivalFailure):
+            market.get_item_price_overviews(session, [(730, 'A'), (730, 'Broken')])
+
+    def test_failures_can_be_collected(self):
+        session = FakeSession(FakeRequestsSession())
+        errors = {}
+        results = market.get_item_price_overviews(session, [(730, 'A'), (730, 'Broken'), (730, 'B')], errors = errors)
+        self.assertEqual(sorted(results), [(730, 'A'), (730, 'B')])
+        self.assertEqual(list(errors), [(730, 'Broken')])
+        self.assertIsInstance(errors[(730, 'Broken')], market.ItemPriceOverviewRetreivalFailure)
+
+    def test_items_without_listings(self):
+        session = FakeSession(FakeRequestsSession())
+        results = market.get_item_price_overviews(session, [(730, 'Unlisted'), (730, 'Unsold')])
+        self.assertEqual(results[(730, 'Unlisted')].low_price, currency.Money(40))
+        self.assertEqual(results[(730, 'Unsold')].low_price, currency.Money(0))
+        self.assertEqual(results[(730, 'Unsold')].median_price, currency.Money(0))
+
+    def test_prices_are_fetched_per_currency(self):
+        session = FakeSession(FakeRequestsSession())
+        usd = market.get_item_price_overview(session, 730, 'A')
+        eur = market.get_item_price_overview(session, 730, 'A', currency = 3)
+        self.assertEqual((usd.low_price, eur.low_price), (currency.Money(25), currency.Money(22, 'EUR')))
+        self.assertEqual([params['currency'] for url, params in session.requests_session.requests], [1, 3])
+
+    def test_conversion_table_answers_from_usd_prices(self):
+        session = FakeSession(FakeRequestsSession())
+        table = currency.ConversionTable(clock = FakeClock())
+        samples = [(730, 'Sample 1'), (730, 'Sample 2')]
+        self.assertEqual(market.refresh_conversion_table(session, table, [1, 3], samples), ['EUR'])
+        self.assertAlmostEqual(table.rate('EUR'), 0.9)
+        self.assertEqual(market.refresh_conversion_table(session, table, [3], samples), [])
+
+        del session.requests_session.requests[:]
+        results = market.get_item_price_overviews(session, [(730, 'A'), (730, 'B')], currency = 3,
+                                                  conversion_table = table)
+        self.assertEqual(results[(730, 'A')].median_price, currency.Money(27, 'EUR'))
+        self.assertEqual([params['currency'] for url, params in session.requests_session.requests], [1, 1])
+
+
+def listing_html(listing_id, name):
+    return ('<div class="market_listing_row">'
+            '<div class="market_listing_item_name_block">'
+            '<span id="mylisting_' + str(listing_id) + '_name" class="market_listing_item_name">'
+            '<a class="market_listing_item_name_link" href="https://steamcommunity.com/market/listings/730/' + name + '">' + name + '</a>'
+            '</span><br/><span class="market_listing_game_name">Counter-Strike: Global Offensive</span>'
+            '</div></div>')
+
+
+class FakeListingsRequestsSession(object):
+    def __init__(self, total_count):
+        self.total_count = total_count
+        self.requests    = []
+
+    def request(self, method, url, params = None, **kwargs):
+        self.requests.append(params)
+        start = params['start']
+        listing_ids = range(start, min(start + params['count'], self.total_count))
+        return FakeResponse({'success'      : True,
+                             'pagesize'     : params['count'],
+                             'total_count'  : self.total_count,
+                             'start'        : start,
+                             'results_html' : ''.join(listing_html(i, 'Item ' + str(i)) for i in listing_ids)})
+
+
+class TestIterCurrentListings(unittest.TestCase):
+
+    def test_pages_through_all_listings(self):
+        session = FakeSession(FakeListingsRequestsSession(5))
+        listings = list(market.iter_current_listings(session, page_size = 2))
+        self.assertEqual([listing.id for listing in listings], ['0', '1', '2', '3', '4'])
+        self.assertEqual(listings[3].item_name, 'Item 3')
+        self.assertEqual(listings[3].game_name, 'Counter-Strike: Global Offensive')
+        self.assertEqual([params['start'] for params in session.requests_session.requests], [0, 2, 4])
+
+
+class FakeRemovalRequestsSession(object):
+    def __init__(self, failures):
+        self.failures = failures
+        self.cookies  = {'sessionid' : 'abc%3D'}
+        self.requests = []
+        self.lock     = threading.Lock()
+
+    def request(self, method, url, data = None, **kwargs):
+        listing_id = url.rsplit('/', 1)[1]
+        with self.lock:
+            self.requests.append((listing_id, data['sessionid']))
+            failures = self.failures.get(listing_id, 0)
+            self.failures[listing_id] = failures - 1
+        return FakeResponse({}, status_code = 500 if failures > 0 else 200)
+
+
+class TestRemoveListings(unittest.TestCase):
+
+    def test_failures_are_collected_and_retried(self):
+        session = FakeSession(FakeRemovalRequestsSession({'2' : 1, '3' : 5}))
+        progress = []
+        summary = market.remove_listings(session, ['1', '2', '3', '1'], workers = 3, max_retries = 2,
+                progress = lambda listing_id, error, done, total: progress.append((done, total)))
+        self.assertEqual(sorted(summary.removed), ['1', '2'])
+        self.assertEqual(list(summary.failed), ['3'])
+        self.assertIsInstance(summary.failed['3'], market.ListingRemovalError)
+        self.assertEqual(sorted(summary.retried), ['2', '3'])
+        self.assertEqual(sorted(progress), [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(len(session.requests_session.requests), 1 + 2 + 3)
+        self.assertEqual(session.requests_session.requests[0][1], 'abc=')
+
+
+class FakeItem(object):
+    def __init__(self, asset_id):
+        self.asset_id = asset_id
+
+    def id(self):
+        return self.asset_id
+
+    def app_id(self):
+        return '730'
+
+
+class FakeSaleRequestsSession(object):
+    def __init__(self):
+        self.cookies  = {'sessionid' : 'abc%3D'}
+        self.requests = []
+
+    def request(self, method, url, data = None, **kwargs):
+        self.requests.append(data)
+        return FakeResponse({}, status_code = 502 if data['assetid'] == 'bad' else 200)
+
+
+class TestPostItemsForSale(unittest.TestCase):
+
+    def test_results_and_errors_per_item(self):
+        session = FakeSession(FakeSaleRequestsSession())
+        profile_lookups = []
+        session.profile_id = lambda: profile_lookups.append(1) or '7656'
+        summary = market.post_items_for_sale(session, [(FakeItem('1'), 100), (FakeItem('bad'), 50), (FakeItem('2'), 25)])
+        self.assertEqual(sorted(summary.posted), ['1', '2'])
+        self.assertIsInstance(summary.failed['bad'], market.ItemSaleError)
+        self.assertEqual(len(profile_lookups), 1)
+        self.assertEqual(session.validations, 1)
+        prices = dict((data['assetid'], data['price']) for data in session.requests_session.requests)
+        self.assertEqual(prices, {'1' : 100, 'bad' : 50, '2' : 25})
+        self.assertTrue(all(data['sessionid'] == 'abc=' for data in session.requests_session.requests))
+
+
+class TestFeeArrays(unittest.TestCase):
+
+    def assert_matches_scalar(self):
+        prices = range(1, 40000)
+        steam_fees, publisher_fees = market.calculate_fees_array(prices)
+        desired_prices = market.get_desired_prices(prices)
+        for index, price in enumerate(prices):
+            self.assertEqual((steam_fees[index], publisher_fees[index]), market.calculate_fees(price))
+            self.assertEqual(desired_prices[index], market.get_desired_price(price))
+
+    @unittest.skipIf(market.numpy is None, "NumPy isn't installed")
+    def test_numpy_versions_match_scalar(self):
+        self.assert_matches_scalar()
+
+    def test_fallback_versions_match_scalar(self):
+        numpy = market.numpy
+        market.numpy = None
+        try:
+            self.assertIsInstance(market.get_desired_prices([100]), array.array)
+            self.assert_matches_scalar()
+        finally:
+            market.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_pool
+----------------------------------
+
+Tests for `desperado.pool` module.
+"""
+
+import threading
+import unittest
+
+import requests
+
+from desperado import pool
+from tests.fakes import FakeSession
+
+
+class TestSessionPool(unittest.TestCase):
+    RATE_LIMITS = { 'sellitem' : { 'rate' : 0.001, 'burst' : 1 } }
+
+    def setUp(self):
+        self.first  = FakeSession(requests.Session(), rate_limits = self.RATE_LIMITS)
+        self.second = FakeSession(requests.Session(), rate_limits = self.RATE_LIMITS)
+        self.pool   = pool.SessionPool([self.first, self.second], max_checkouts = 1, pool_maxsize = 16)
+
+    def test_adapters_are_sized(self):
+        adapter = self.first.requests_session.get_adapter('https://steamcommunity.com/')
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+    def test_checkout_prefers_session_with_tokens(self):
+        # Spend the first account's only sellitem token, it won't get another for a long time.
+        self.first.transport.buckets['sellitem'].reserve()
+        with self.pool.session('sellitem') as session:
+            self.assertIs(session, self.second)
+            self.assertEqual(session.validations, 1)
+        # Families without a rate limit are spread around.
+        self.assertIs(self.pool.checkout('inventory'), self.first)
+        self.assertIs(self.pool.checkout('inventory'), self.second)
+
+    def test_checkout_waits_for_checkin(self):
+        self.pool.checkout('inventory')
+        self.pool.checkout('inventory')
+        with self.assertRaises(pool.PoolExhausted):
+            self.pool.checkout('inventory', timeout = 0.01)
+        threading.Timer(0.05, self.pool.checkin, [self.second]).start()
+        self.assertIs(self.pool.checkout('inventory', timeout = 5), self.second)
+
+    def test_map_spreads_items_over_sessions(self):
+        results = self.pool.map('inventory', lambda session, item: (id(session), item * 2), range(6))
+        self.assertEqual([value for session_id, value in results], [0, 2, 4, 6, 8, 10])
+        self.assertEqual(set(session_id for session_id, value in results), set([id(self.first), id(self.second)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_snapshot
+----------------------------------
+
+Tests for `desperado.snapshot` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desperado import catalog
+from desperado import inventory
+from desperado import snapshot
+
+
+def make_item(asset_id, class_id, name, tradable, tags):
+    description = inventory.ItemDescription({
+        'appid'            : '730',
+        'classid'          : str(class_id),
+        'instanceid'       : '0',
+        'market_name'      : name,
+        'market_hash_name' : name,
+        'tradable'         : tradable,
+        'tags'             : [{'category' : category, 'name' : value} for category, value in tags.items()]})
+    return inventory.InventoryItem(asset_id, class_id, 0, 1, description)
+
+
+class TestInventorySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'csgo.snapshot')
+        self.items = [
+            make_item(11, 100, 'Chroma Case',           1, {'Type' : 'Container'}),
+            make_item(12, 200, u'StatTrak™ AK-47', 1, {'Type' : 'Rifle', 'Quality' : u'StatTrak™'}),
+            make_item(13, 100, 'Chroma Case',           1, {'Type' : 'Container'}),
+            make_item(14, 300, 'Souvenir Package',      0, {'Type' : 'Container'})]
+        snapshot.save_snapshot(inventory.Inventory('76561198000000000', self.items, 730, 2), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        loaded = snapshot.load_snapshot(self.path)
+        self.assertEqual((loaded.profile_id, loaded.app_id, loaded.context_id), ('76561198000000000', 730, 2))
+        self.assertEqual([(item.id(), item.class_id(), item.market_hash_name(), item.can_trade(), item.tags)
+                          for item in loaded.items],
+                         [(item.id(), item.class_id(), item.market_hash_name(), item.can_trade(), item.tags)
+                          for item in self.items])
+        self.assertIs(loaded.items[0].description, loaded.items[2].description)
+
+    def test_descriptions_are_stored_once(self):
+        with snapshot.InventorySnapshot(self.path) as view:
+            self.assertEqual(len(view), 4)
+            self.assertEqual(view.description_count, 3)
+            self.assertEqual(view.asset(2), (13, 100, 0, 1, 0))
+            self.assertEqual(view[-1].market_name(), 'Souvenir Package')
+
+    def test_where(self):
+        with snapshot.InventorySnapshot(self.path) as view:
+            self.assertEqual([item.id() for item in view.where(Type = 'Container', tradable = True)], [11, 13])
+            self.assertEqual([item.id() for item in view.where(Quality__contains = 'stattrak')], [12])
+            self.assertEqual([item.id() for item in view.where(market_hash_name = 'Missing')], [])
+
+    def test_descriptions_resolve_through_catalog(self):
+        descriptions = catalog.DescriptionCatalog()
+        known = descriptions.add(self.items[0].description)
+        loaded = snapshot.load_snapshot(self.path, descriptions)
+        self.assertIs(loaded.items[0].description, known)
+        self.assertIs(snapshot.load_snapshot(self.path, descriptions).items[1].description,
+                      loaded.items[1].description)
+        self.assertEqual(len(descriptions), 3)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'{"version" : 1}' + b' ' * 100)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.InventorySnapshot(self.path)
+        self.assertIsNone(inventory.load_inventory_snapshot(self.path))
+
+    def test_rejects_truncated_and_corrupt_files(self):
+        with open(self.path, 'rb') as infile:
+            body = infile.read()
+
+        with open(self.path, 'wb') as outfile:
+            outfile.write(body[:-10])
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.InventorySnapshot(self.path)
+        self.assertIsNone(inventory.load_inventory_snapshot(self.path))
+
+        # Point the first asset at a description that doesn't exist.
+        corrupt = bytearray(body)
+        snapshot.ASSET_RECORD.pack_into(corrupt, snapshot.HEADER.size, 1, 1, 0, 1, 1000)
+        with open(self.path, 'wb') as outfile:
+            outfile.write(corrupt)
+        with snapshot.InventorySnapshot(self.path) as loaded:
+            with self.assertRaises(snapshot.SnapshotError):
+                loaded[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_storage
+----------------------------------
+
+Tests for `desperado.storage` module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from desperado import storage
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'table.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replaces_the_file(self):
+        with storage.atomic_write(self.path) as outfile:
+            outfile.write('old')
+        with storage.atomic_write(self.path) as outfile:
+            outfile.write('new')
+        with open(self.path) as infile:
+            self.assertEqual(infile.read(), 'new')
+        self.assertEqual(os.listdir(self.directory), ['table.json'])
+
+    def test_failed_write_leaves_the_old_file(self):
+        with storage.atomic_write(self.path) as outfile:
+            outfile.write('old')
+        with self.assertRaises(ValueError):
+            with storage.atomic_write(self.path) as outfile:
+                outfile.write('half')
+                raise ValueError('serialization failed')
+        with open(self.path) as infile:
+            self.assertEqual(infile.read(), 'old')
+        self.assertEqual(os.listdir(self.directory), ['table.json'])
+
+
+class TestThreadConnections(unittest.TestCase):
+
+    def test_one_connection_per_thread(self):
+        directory = tempfile.mkdtemp()
+        try:
+            connections = storage.ThreadConnections(os.path.join(directory, 'cache.sqlite'))
+            self.assertIs(connections.get(), connections.get())
+            others = []
+            thread = threading.Thread(target = lambda: others.append(connections.get()))
+            thread.start()
+            thread.join()
+            self.assertIsNot(others[0], connections.get())
+            self.assertEqual(connections.get().execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_transport
+----------------------------------
+
+Tests for `desperado.transport` module.
+"""
+
+import email.utils
+import threading
+import time
+import unittest
+
+from desperado import transport
+from tests.fakes import FakeResponse
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now    = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRequestsSession(object):
+    def __init__(self, status_codes, headers = None):
+        self.status_codes = list(status_codes)
+        self.headers      = {'Retry-After' : '7'} if headers is None else headers
+        self.requests     = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return FakeResponse(status_code = self.status_codes.pop(0), headers = self.headers)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.time   = FakeTime()
+        self.bucket = transport.TokenBucket(2.0, burst = 2, clock = self.time.clock, sleep = self.time.sleep)
+
+    def test_burst_is_free_then_requests_are_spaced(self):
+        for _ in range(4):
+            self.bucket.acquire()
+        self.assertEqual(self.time.sleeps, [0.5, 0.5])
+        self.assertEqual(self.time.now, 1.0)
+
+    def test_reservations_queue(self):
+        waits = [self.bucket.reserve() for _ in range(5)]
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0, 1.5])
+
+    def test_refills_up_to_burst(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.time.now += 10
+        self.assertEqual(self.bucket.delay(), 0.0)
+        self.assertEqual([self.bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.5])
+
+    def test_drain(self):
+        self.bucket.drain(3)
+        self.assertEqual(self.bucket.delay(), 3.0)
+
+    def test_drain_pushes_back_pending_reservations(self):
+        throttled = []
+
+        def sleep(seconds):
+            if not throttled:
+                # Another caller hits a 429 while this one waits for its reservation.
+                throttled.append(seconds)
+                bucket.drain(3)
+            self.time.sleep(seconds)
+
+        bucket = transport.TokenBucket(2.0, burst = 2, clock = self.time.clock, sleep = sleep)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(bucket.acquire(), 3.5)
+        self.assertEqual(self.time.sleeps, [0.5, 3.0])
+        # The next reservation queues behind the penalty and the one that was pushed back.
+        self.assertEqual(bucket.reserve(), 0.5)
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_throttled_requests_are_retried(self):
+        fake_time = FakeTime()
+        requests_session = FakeRequestsSession([429, 200])
+        steam = transport.Transport(requests_session, rate_limits = {}, sleep = fake_time.sleep)
+        steam.buckets['priceoverview'] = transport.TokenBucket(1.0, burst = 1,
+                clock = fake_time.clock, sleep = fake_time.sleep)
+        response = steam.get('priceoverview', 'https://steamcommunity.com/market/priceoverview/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(requests_session.requests), 2)
+        self.assertEqual(fake_time.sleeps, [7.0])
+
+    def test_backoff_doubles_without_retry_after(self):
+        fake_time = FakeTime()
+        requests_session = FakeRequestsSession([429, 429, 429, 200], headers = {})
+        steam = transport.Transport(requests_session, rate_limits = {}, backoff = 2.0, sleep = fake_time.sleep)
+        self.assertEqual(steam.get('sellitem', 'https://example').status_code, 200)
+        self.assertEqual(fake_time.sleeps, [2.0, 4.0, 8.0])
+
+    def test_retry_after_date(self):
+        fake_time = FakeTime()
+        retry_at = email.utils.formatdate(time.time() + 60, usegmt = True)
+        requests_session = FakeRequestsSession([429, 200], headers = {'Retry-After' : retry_at})
+        steam = transport.Transport(requests_session, rate_limits = {}, sleep = fake_time.sleep)
+        steam.get('sellitem', 'https://example')
+        self.assertTrue(55 <= fake_time.sleeps[0] <= 60)
+
+    def test_gives_up_after_max_retries(self):
+        requests_session = FakeRequestsSession([429, 429])
+        steam = transport.Transport(requests_session, rate_limits = {}, max_retries = 0)
+        self.assertEqual(steam.post('sellitem', 'https://example').status_code, 429)
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, flight, function, count = 5):
+        results = []
+        errors  = []
+
+        def call():
+            try:
+                results.append(flight.do(('priceoverview', 730, 'Item'), function))
+            except (ValueError, Interrupted) as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target = call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        flight  = transport.SingleFlight()
+        release = threading.Event()
+        calls   = []
+
+        def fetch():
+            calls.append(1)
+            release.wait()
+            return 'price'
+
+        threads, results, errors = self.run_concurrently(flight, fetch)
+        # Give every thread time to join the call in flight.
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['price'] * 5)
+        self.assertEqual(len(flight), 0)
+
+    def test_waiting_callers_get_the_error(self):
+        flight  = transport.SingleFlight()
+        release = threading.Event()
+
+        def fetch():
+            release.wait()
+            raise ValueError('throttled')
+
+        threads, results, errors = self.run_concurrently(flight, fetch, count = 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(results, [])
+
+    def test_waiting_callers_get_base_exceptions(self):
+        flight  = transport.SingleFlight()
+        release = threading.Event()
+
+        def fetch():
+            release.wait()
+            raise Interrupted()
+
+        threads, results, errors = self.run_concurrently(flight, fetch, count = 3)
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([type(error) for error in errors], [Interrupted] * 3)
+        self.assertEqual(results, [])
+
+
+if __name__ == '__main__':
+    unittest.main()